@@ -0,0 +1,226 @@
+"""Eigenbasis artifact (.efb) shared by the trainer and every consumer.
+
+Layout (little endian):
+
+    offset 0     header, padded to HEADER_SIZE bytes
+                   magic     4s   b"EFB1"
+                   version   u16
+                   dtype     u8   DTYPE_CODES
+                   flags     u8   bit 0: eigen values present
+                   k         u32  number of stored eigenfaces
+                   height    u16
+                   width     u16
+                   checksum  u32  crc32 of everything after the header
+    HEADER_SIZE  components  k x (height * width) in dtype, row i is eigenface i
+                 mean face   height * width float32
+                 eigen vals  k float32 (zeros unless flag bit 0 is set)
+                 scales      k float32, int8 only: eigenface i is components[i] * scales[i]
+
+Components are stored row-major and already truncated, so projecting a
+batch is ``faces @ components.T`` and reconstructing is
+``coeffs @ components`` straight off the memory map, and opening with a
+smaller k is a zero-copy prefix slice.
+
+float16 and int8 storage halve or quarter the artifact (58 MB for 1000
+float32 eigenfaces). int8 stores every eigenface with its own scale
+(max |weight| / 127), and EigenfaceCodec dequantizes it a block of
+eigenfaces at a time into a cache-sized float32 scratch, so a projection
+streams a quarter of the bytes. See evaluate.py --compare for the
+accuracy cost against float32.
+"""
+import argparse
+import os
+import struct
+import zlib
+
+import numpy as np
+
+###################################### VARIABLES ######################################
+
+MAGIC = b"EFB1"
+VERSION = 1
+HEADER_FORMAT = "<4sHBBIHHI"
+HEADER_SIZE = 4096  # Page aligned so the component block can be mapped directly
+
+DTYPE_CODES = {1: np.float32, 2: np.float16, 3: np.int8}
+STORAGE_DTYPES = {"float32": 1, "float16": 2, "int8": 3}
+INT8_MAX = 127
+FLAG_EIGEN_VALUES = 1
+
+COLUMN_BLOCK = 256  # Eigenfaces converted per block when writing
+
+########################################################################################
+
+
+class Basis:
+    """Memory-mapped eigenbasis: components (k x d), mean (d,), eigen_values (k,) or None.
+
+    components keep their storage dtype; for int8 bases scales (k,) holds the
+    per-eigenface factor, otherwise it is None.
+    """
+
+    def __init__(self, components, mean, eigen_values, height, width, scales=None):
+        self.components = components
+        self.mean = mean
+        self.eigen_values = eigen_values
+        self.height = height
+        self.width = width
+        self.scales = scales
+
+    @property
+    def k(self):
+        return self.components.shape[0]
+
+    @property
+    def dim(self):
+        return self.components.shape[1]
+
+
+def quantize_int8(block):
+    """Rows of a float32 block -> (int8 rows, float32 per-row scales)."""
+    scales = np.abs(block).max(axis=1) / INT8_MAX
+    scales[scales == 0] = 1
+    return np.clip(np.rint(block / scales[:, None]), -INT8_MAX, INT8_MAX).astype(np.int8), scales.astype(np.float32)
+
+
+def write_basis(path, eigen_faces, mean_face, eigen_values=None, k=None, resolution=(120, 120), dtype="float32"):
+    """Write a d x K eigenface matrix (notebook orientation) as a k-truncated .efb file.
+
+    dtype is one of STORAGE_DTYPES.
+    """
+    if dtype not in STORAGE_DTYPES:
+        raise ValueError(f"Unknown basis dtype {dtype!r}, expected one of {list(STORAGE_DTYPES)}")
+    height, width = resolution
+    dim = height * width
+    k = eigen_faces.shape[1] if k is None else min(k, eigen_faces.shape[1])
+    if eigen_faces.shape[0] != dim:
+        raise ValueError(f"Eigenfaces have {eigen_faces.shape[0]} pixels, expected {dim}")
+
+    flags = 0
+    values = np.zeros(k, dtype=np.float32)
+    if eigen_values is not None:
+        flags |= FLAG_EIGEN_VALUES
+        values = np.ascontiguousarray(np.real(eigen_values[:k]), dtype=np.float32)
+    mean = np.ascontiguousarray(np.asarray(mean_face).reshape(-1), dtype=np.float32)
+
+    tmp_path = path + ".tmp"
+    checksum = 0
+    scales = []
+    with open(tmp_path, "wb") as f:
+        f.write(b"\0" * HEADER_SIZE)
+        for start in range(0, k, COLUMN_BLOCK):
+            block = np.ascontiguousarray(np.real(eigen_faces[:, start:min(start + COLUMN_BLOCK, k)]).T,
+                                         dtype=np.float32)
+            if dtype == "int8":
+                block, block_scales = quantize_int8(block)
+                scales.append(block_scales)
+            else:
+                block = block.astype(DTYPE_CODES[STORAGE_DTYPES[dtype]], copy=False)
+            checksum = zlib.crc32(block, checksum)
+            f.write(block.tobytes())
+        tail = [mean, values] + ([np.concatenate(scales)] if scales else [])
+        for block in tail:
+            checksum = zlib.crc32(block, checksum)
+            f.write(block.tobytes())
+        f.seek(0)
+        f.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, STORAGE_DTYPES[dtype], flags, k, height, width, checksum))
+    os.replace(tmp_path, path)
+
+
+def read_header(path):
+    with open(path, "rb") as f:
+        raw = f.read(struct.calcsize(HEADER_FORMAT))
+    magic, version, dtype_code, flags, k, height, width, checksum = struct.unpack(HEADER_FORMAT, raw)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not an eigenbasis file")
+    if version != VERSION or dtype_code not in DTYPE_CODES:
+        raise ValueError(f"{path}: unsupported version {version} / dtype {dtype_code}")
+    return {"k": k, "height": height, "width": width, "dtype": DTYPE_CODES[dtype_code],
+            "flags": flags, "checksum": checksum}
+
+
+def open_basis(path, k=None, verify=False):
+    """Memory-map an .efb file, keeping only the first k eigenfaces (all when k is None)."""
+    header = read_header(path)
+    stored_k, dim = header["k"], header["height"] * header["width"]
+    scaled = header["dtype"] == np.int8
+    components_size = stored_k * dim * np.dtype(header["dtype"]).itemsize
+    tail_size = dim + stored_k + (stored_k if scaled else 0)
+    if verify:
+        data = np.memmap(path, dtype=np.uint8, mode="r", offset=HEADER_SIZE, shape=(components_size + 4 * tail_size,))
+        if zlib.crc32(data) != header["checksum"]:
+            raise ValueError(f"{path}: checksum mismatch")
+
+    k = stored_k if k is None else k
+    if k > stored_k:
+        raise ValueError(f"{path} only stores {stored_k} eigenfaces, {k} requested")
+    components = np.memmap(path, dtype=header["dtype"], mode="r", offset=HEADER_SIZE, shape=(stored_k, dim))[:k]
+    tail = np.memmap(path, dtype=np.float32, mode="r", offset=HEADER_SIZE + components_size, shape=(tail_size,))
+    mean = tail[:dim]
+    eigen_values = None
+    if header["flags"] & FLAG_EIGEN_VALUES:
+        eigen_values = tail[dim:dim + stored_k][:k]
+    scales = tail[dim + stored_k:][:k] if scaled else None
+    return Basis(components, mean, eigen_values, header["height"], header["width"], scales)
+
+
+def convert_basis(path, output, dtype):
+    """Re-encode a float32 .efb basis with another storage dtype (see STORAGE_DTYPES)."""
+    basis = open_basis(path)
+    if basis.components.dtype != np.float32:
+        raise ValueError(f"{path} is stored as {basis.components.dtype}, convert from the float32 original")
+    write_basis(output, basis.components.T, basis.mean, basis.eigen_values, resolution=(basis.height, basis.width),
+                dtype=dtype)
+
+
+def ensure_basis(basis_path, eigen_path, mean_path, k=None):
+    """Convert legacy eigen_faces/mean_faces .npy files to basis_path when it is missing or stale.
+
+    A deployment may ship only the .efb; without the .npy it is used as is.
+    """
+    if os.path.exists(basis_path) and (not os.path.exists(eigen_path)
+                                       or os.path.getmtime(basis_path) >= os.path.getmtime(eigen_path)):
+        return basis_path
+    if not os.path.exists(eigen_path):
+        raise ValueError(f"Neither {basis_path} nor {eigen_path} exists")
+    values_path = os.path.join(os.path.dirname(eigen_path),
+                               os.path.basename(eigen_path).replace("eigen_faces", "eigen_values"))
+    eigen_values = np.load(values_path) if values_path != eigen_path and os.path.exists(values_path) else None
+    print(f"Converting {eigen_path} to {basis_path}")
+    write_basis(basis_path, np.load(eigen_path, mmap_mode="r"), np.load(mean_path), eigen_values, k)
+    return basis_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert eigen_faces/mean_faces .npy files (or a float32 .efb) "
+                                                 "to an .efb basis")
+    parser.add_argument('eigen_faces', help="d x K eigenface matrix (.npy), or a float32 .efb to re-encode")
+    parser.add_argument('mean_face', nargs='?', help="Mean face vector (.npy); not used when converting an .efb")
+    parser.add_argument('output', nargs='?', help="Destination .efb file")
+    parser.add_argument('--out', help="Destination .efb file (required when converting an .efb)")
+    parser.add_argument('--k', type=int, default=None, help="Keep only the first k eigenfaces")
+    parser.add_argument('--eigen_values', default=None, help="Eigenvalue vector (.npy), optional")
+    parser.add_argument('--dtype', choices=list(STORAGE_DTYPES), default="float32", help="Component storage")
+
+    args = parser.parse_args()
+
+    if args.eigen_faces.endswith(".efb"):
+        if args.mean_face is not None or args.output is not None:
+            parser.error("converting an .efb takes no mean face or positional output; pass the destination with --out")
+        if args.out is None:
+            parser.error("--out is required when converting an .efb")
+        args.output = args.out
+        convert_basis(args.eigen_faces, args.output, args.dtype)
+    else:
+        if args.mean_face is None:
+            parser.error("the mean face .npy is required")
+        if args.output is not None and args.out is not None:
+            parser.error("give the output .efb either positionally or with --out, not both")
+        args.output = args.output or args.out
+        if args.output is None:
+            parser.error("the output .efb is required")
+        eigen_values = np.load(args.eigen_values) if args.eigen_values else None
+        write_basis(args.output, np.load(args.eigen_faces, mmap_mode="r"), np.load(args.mean_face), eigen_values,
+                    args.k, dtype=args.dtype)
+    basis = open_basis(args.output, verify=True)
+    print(f"Wrote {basis.k} {basis.components.dtype} eigenfaces ({basis.height}x{basis.width}) to {args.output}")
@@ -0,0 +1,214 @@
+"""Headless benchmark of the detect -> crop -> encode -> decode path, reported as JSON.
+
+Frames come from a recorded video, or from a synthetic sequence: faces from
+dataset.py's tensor drifting over a noisy background, whose ground-truth
+boxes stand in for a detector (backend "synthetic"), so the codec can be
+benchmarked where no detector weights are available.
+
+Frames are decoded up front, so decoding isn't timed. Detection runs once
+per backend (through the same scheduler and region detector as the live
+scripts) and its boxes are reused for every k; crop, encode and decode are
+then timed per k, with float32 and, when the basis has eigenvalues,
+quantized payloads. Every run reports frames/s, per-stage p50/p99 latency,
+wire bytes per frame (protocol.pack_frame datagrams) and PSNR of the
+decoded faces against their crops. Save the JSON of two commits and diff it
+to compare them.
+
+    python benchmark.py eigen_faces.efb --synthetic faces.npy --k 50 100 200 -o bench.json
+    python benchmark.py eigen_faces.efb --video clip.mp4 --backends ultralytics onnxruntime
+"""
+import argparse
+import json
+import subprocess
+import time
+
+import cv2
+import numpy as np
+
+from basis import open_basis
+from codec import CodecBuffers, EigenfaceCodec, crop_faces
+from detection import BACKENDS, DETECTION_SCALE, make_detector, RegionDetector, WEIGHTS
+from protocol import pack_frame
+from quantize import CoefficientQuantizer
+from tracking import DetectionScheduler
+
+###################################### VARIABLES ######################################
+
+K_VALUES = (50, 100, 200, 400, 700)
+FRAMES = 300
+FRAME_SIZE = (640, 480)  # Synthetic frames, width x height
+FACE_SIZE = 160  # Synthetic face box side in pixels
+SWITCH_INTERVAL = 60  # Synthetic frames between changes of face
+PEAK = 255.0
+
+########################################################################################
+
+
+def read_video(path, frames=FRAMES):
+    """Up to frames BGR frames of a video file."""
+    cap = cv2.VideoCapture(path)
+    decoded = []
+    while len(decoded) < frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        decoded.append(frame)
+    cap.release()
+    if not decoded:
+        raise ValueError(f"No frames read from {path}")
+    return decoded
+
+
+def synthetic_sequence(faces, frames=FRAMES, size=FRAME_SIZE, face_size=FACE_SIZE, seed=0):
+    """(frames, boxes): a dataset face drifting along a Lissajous path over a noisy background.
+
+    boxes[i] is the 1 x 4 int32 xyxy ground-truth box of frame i.
+    """
+    rng = np.random.default_rng(seed)
+    width, height = size
+    background = cv2.GaussianBlur(rng.integers(0, 256, (height, width), dtype=np.uint8), (0, 0), 3)
+    sequence, boxes = [], []
+    for i in range(frames):
+        if i % SWITCH_INTERVAL == 0:
+            face = cv2.resize(np.asarray(faces[rng.integers(len(faces))]), (face_size, face_size))
+        t = 2 * np.pi * i / frames
+        x = int((width - face_size) * (0.5 + 0.4 * np.sin(2 * t)))
+        y = int((height - face_size) * (0.5 + 0.4 * np.sin(3 * t)))
+        gray = background.copy()
+        gray[y:y + face_size, x:x + face_size] = face
+        sequence.append(cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR))
+        boxes.append(np.array([[x, y, x + face_size, y + face_size]], dtype=np.int32))
+    return sequence, boxes
+
+
+def latency_stats(seconds):
+    seconds = np.asarray(seconds) * 1000
+    return {"p50_ms": round(float(np.percentile(seconds, 50)), 3), "p99_ms": round(float(np.percentile(seconds, 99)), 3)}
+
+
+def run_detection(frames, detector):
+    """(boxes per frame, per-frame seconds) through the live scripts' scheduler and region detector."""
+    scheduler = DetectionScheduler(RegionDetector(detector, DETECTION_SCALE))
+    boxes, times = [], []
+    for frame in frames:
+        start = time.perf_counter()
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        boxes.append(scheduler(frame, gray))
+        times.append(time.perf_counter() - start)
+    return boxes, times
+
+
+def run_codec(frames, boxes, codec, quantizer=None):
+    """Crop, encode, (quantize and) decode every frame; per-stage seconds, bytes per frame and per-face MSE."""
+    buffers = CodecBuffers(codec)
+    times = {"crop": [], "encode": [], "decode": []}
+    frame_bytes, errors = [], []
+    for seq, (frame, frame_boxes) in enumerate(zip(frames, boxes)):
+        start = time.perf_counter()
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        faces, _, _ = crop_faces(gray, frame_boxes, out=buffers.faces)
+        crop_done = time.perf_counter()
+        coeffs = codec.encode(faces, buffers=buffers)
+        datagrams = [pack_frame(seq, face_coeffs, face_id=i, quantizer=quantizer) for i, face_coeffs in enumerate(coeffs)]
+        encode_done = time.perf_counter()
+        if quantizer is not None:
+            for face_coeffs in coeffs:
+                quantizer.dequantize(quantizer.quantize(face_coeffs), out=face_coeffs)
+        decoded = codec.decode(coeffs, buffers)
+        decode_done = time.perf_counter()
+
+        times["crop"].append(crop_done - start)
+        times["encode"].append(encode_done - crop_done)
+        times["decode"].append(decode_done - encode_done)
+        frame_bytes.append(sum(len(datagram) for face in datagrams for datagram in face))
+        diff = faces.reshape(len(faces), -1).astype(np.float32) - decoded.reshape(len(faces), -1)
+        errors.extend(np.mean(diff * diff, axis=1))
+    return times, frame_bytes, errors
+
+
+def psnr(mse):
+    return round(float(10 * np.log10(PEAK ** 2 / max(mse, 1e-10))), 3)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark(basis_path, frames, backends, k_values, truth=None, weights=WEIGHTS, quantized=True):
+    """One result dict per (backend, k, payload); truth is the synthetic ground-truth boxes."""
+    stored = open_basis(basis_path)
+    results = []
+    for backend in backends:
+        if backend == "synthetic":
+            boxes, detect_times = truth, [0.0] * len(frames)
+        else:
+            detector = make_detector(backend, weights)
+            run_detection(frames[:10], detector)  # Warm-up
+            boxes, detect_times = run_detection(frames, detector)
+        for k in k_values:
+            if k > stored.k:
+                raise ValueError(f"{basis_path} only stores {stored.k} eigenfaces, k={k} requested")
+            basis = open_basis(basis_path, k)
+            codec = EigenfaceCodec(basis)
+            payloads = [("float32", None)]
+            if quantized and basis.eigen_values is not None:
+                payloads.append(("quantized", CoefficientQuantizer(basis.eigen_values)))
+            for payload, quantizer in payloads:
+                times, frame_bytes, errors = run_codec(frames, boxes, codec, quantizer)
+                times = {"detect": detect_times, **times}
+                total = np.sum([np.sum(stage) for stage in times.values()])
+                results.append({
+                    "backend": backend, "k": k, "payload": payload,
+                    "fps": round(float(len(frames) / total), 2),
+                    "stages": {name: latency_stats(stage) for name, stage in times.items()},
+                    "faces_per_frame": round(len(errors) / len(frames), 3),
+                    "bytes_per_frame": round(float(np.mean(frame_bytes)), 1),
+                    "psnr_db": psnr(np.mean(errors)) if errors else None,
+                })
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless codec/detector benchmark on recorded or synthetic frames (JSON)")
+    parser.add_argument('basis', help="Eigenbasis (.efb)")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--video', help="Recorded video file")
+    source.add_argument('--synthetic', metavar='FACES', help="uint8 N x 120 x 120 face tensor, e.g. dataset.py's faces.npy")
+    parser.add_argument('--frames', type=int, default=FRAMES)
+    parser.add_argument('--k', type=int, nargs='+', default=list(K_VALUES))
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS + ("synthetic",),
+                        help="Detectors to run (default: synthetic boxes for --synthetic, the configured detector otherwise)")
+    parser.add_argument('--weights', default=WEIGHTS)
+    parser.add_argument('--no-quantized', action='store_true', help="Only benchmark float32 payloads")
+    parser.add_argument('-o', '--output', help="Write the JSON here instead of stdout")
+
+    args = parser.parse_args()
+
+    truth = None
+    if args.video:
+        frames = read_video(args.video, args.frames)
+        backends = args.backends or ["ultralytics"]
+        if "synthetic" in backends:
+            parser.error("the synthetic backend needs --synthetic")
+    else:
+        frames, truth = synthetic_sequence(np.load(args.synthetic, mmap_mode='r'), args.frames)
+        backends = args.backends or ["synthetic"]
+
+    report = {
+        "commit": git_commit(),
+        "source": args.video or f"synthetic:{args.synthetic}",
+        "frames": len(frames),
+        "frame_size": list(frames[0].shape[1::-1]),
+        "basis": args.basis,
+        "runs": benchmark(args.basis, frames, backends, args.k, truth, args.weights, not args.no_quantized),
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
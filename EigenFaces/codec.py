@@ -0,0 +1,281 @@
+import argparse
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+###################################### VARIABLES ######################################
+
+MAX_FACES = 8  # Faces per frame that CodecBuffers hold; crop_faces ignores the rest
+COMPONENT_BLOCK = 16  # int8 eigenfaces dequantized at a time (16 x 14400 float32 = 0.9 MB scratch, L2-sized)
+
+########################################################################################
+
+
+def face_boxes(results):
+    """Collect every YOLO detection in results as an N x 4 int array of (x1, y1, x2, y2)."""
+    boxes = [box.xyxy[0].tolist() for result in results for box in result.boxes]
+    return np.array(boxes, dtype=np.int32).reshape(-1, 4)
+
+
+def crop_faces(gray_frame, boxes, size=(120, 120), out=None):
+    """Crop and resize every box of a grayscale frame.
+
+    Returns (faces, kept, original_sizes): faces is B x height x width uint8,
+    kept indexes the boxes that produced a non-empty crop. With out (e.g.
+    CodecBuffers.faces) the crops are resized straight into it, faces is a
+    view of its first B entries and boxes beyond its length are ignored.
+    """
+    faces, kept, original_sizes = [], [], []
+    for i, (x1, y1, x2, y2) in enumerate(boxes):
+        face = gray_frame[max(y1, 0):y2, max(x1, 0):x2]
+        if face.size == 0:
+            continue
+        if out is None:
+            faces.append(cv2.resize(face, size))
+        elif len(kept) < len(out):
+            cv2.resize(face, size, dst=out[len(kept)])
+        else:
+            break
+        kept.append(i)
+        original_sizes.append(face.size)
+    if out is not None:
+        return out[:len(kept)], kept, original_sizes
+    faces = np.stack(faces) if faces else np.empty((0, size[1], size[0]), dtype=np.uint8)
+    return faces, kept, original_sizes
+
+
+def _squared_norms(X, out, scratch):
+    """out[i] = ||X[i]||^2 summed in float64, a row at a time through a float64 scratch (no B x d copy)."""
+    for i in range(len(X)):
+        row = scratch[:X.shape[1]]
+        np.copyto(row, X[i])
+        np.dot(row[None], row, out=out[i:i + 1])
+    return out
+
+
+class EigenfaceCodec:
+    """Batched PCA encoder/decoder over a Basis (see basis.py).
+
+    Faces are handled as a B x d matrix so a whole frame (or several frames)
+    is projected and reconstructed with one GEMM each. An int8 basis is
+    never expanded as a whole: every COMPONENT_BLOCK eigenfaces are
+    converted into a small float32 scratch that stays in cache and
+    multiplied from there, so the memory-bound pass over the basis reads
+    one byte per weight instead of four. numpy's float16 -> float32 cast
+    is not vectorized (it costs about 10x a float32 GEMV per block), so a
+    float16 basis is expanded to float32 once here instead: it only
+    halves the artifact and what is read from disk.
+    """
+
+    def __init__(self, basis):
+        self.components = basis.components  # k x d, float32 or int8
+        if self.components.dtype == np.float16:
+            self.components = np.asarray(self.components, dtype=np.float32)
+        self.scales = basis.scales  # Per-eigenface int8 scales, or None
+        self.mean = basis.mean
+        self.shape = (basis.height, basis.width)
+        self.blocked = self.components.dtype != np.float32
+
+    @property
+    def k(self):
+        return self.components.shape[0]
+
+    @property
+    def dim(self):
+        return self.components.shape[1]
+
+    def encode(self, faces, return_energy=False, buffers=None):
+        """B x h x w (or B x d) faces -> B x k float32 coefficients.
+
+        With return_energy, also returns ||face - mean||^2 per face, which is
+        all estimate_errors needs besides the coefficients.
+        """
+        if buffers is None:
+            X = np.asarray(faces, dtype=np.float32).reshape(-1, self.dim) - self.mean
+            coeffs = self._project(X, np.empty((len(X), self.k), dtype=np.float32)) if self.blocked \
+                else X @ self.components.T
+            energy = None
+        else:
+            n = len(faces)
+            X = buffers.centered[:n]
+            np.copyto(X, np.reshape(faces, (n, self.dim)))  # Unbuffered cast; a mixed-type subtract would allocate
+            X -= self.mean
+            coeffs = self._project(X, buffers.coeffs[:n], buffers)
+            energy = buffers.energy[:n]
+        if not return_energy:
+            return coeffs
+        if buffers is None:
+            return coeffs, np.einsum('ij,ij->i', X, X, dtype=np.float64)
+        return coeffs, _squared_norms(X, energy, buffers.row)
+
+    def _dequantize(self, start, stop, scratch):
+        """float32 eigenfaces [start, stop) in scratch, without the int8 scales."""
+        block = scratch[:stop - start]
+        np.copyto(block, self.components[start:stop], casting='unsafe')
+        return block
+
+    def _project(self, X, out, buffers=None):
+        """out = X @ components.T, a block of eigenfaces at a time for int8 bases."""
+        if not self.blocked:
+            return np.matmul(X, self.components.T, out=out)
+        n = len(X)
+        scratch = buffers.block if buffers is not None else np.empty((COMPONENT_BLOCK, self.dim), dtype=np.float32)
+        partial = buffers.block_coeffs[:n] if buffers is not None else np.empty((n, COMPONENT_BLOCK), dtype=np.float32)
+        for start in range(0, self.k, COMPONENT_BLOCK):
+            stop = min(start + COMPONENT_BLOCK, self.k)
+            product = np.matmul(X, self._dequantize(start, stop, scratch).T, out=partial[:, :stop - start])
+            if self.scales is not None:
+                product *= self.scales[start:stop]
+            out[:, start:stop] = product
+        return out
+
+    def _reconstruct(self, coeffs, out, buffers=None):
+        """out = coeffs @ components[:k'] + mean, blocked like _project."""
+        if not self.blocked:
+            np.matmul(coeffs, self.components[:coeffs.shape[1]], out=out)
+            out += self.mean
+            return out
+        n = len(coeffs)
+        if buffers is not None:
+            scratch, block_coeffs, partial = buffers.block, buffers.block_coeffs[:n], buffers.partial[:n]
+        else:
+            scratch = np.empty((COMPONENT_BLOCK, self.dim), dtype=np.float32)
+            block_coeffs = np.empty((n, COMPONENT_BLOCK), dtype=np.float32)
+            partial = np.empty((n, self.dim), dtype=np.float32)
+        out[:] = self.mean
+        for start in range(0, coeffs.shape[1], COMPONENT_BLOCK):
+            stop = min(start + COMPONENT_BLOCK, coeffs.shape[1])
+            scaled = block_coeffs[:, :stop - start]
+            np.copyto(scaled, coeffs[:, start:stop])
+            if self.scales is not None:
+                scaled *= self.scales[start:stop]
+            out += np.matmul(scaled, self._dequantize(start, stop, scratch), out=partial)
+        return out
+
+    def estimate_errors(self, energy, coeffs, buffers=None):
+        """Unclipped per-face MSE from coefficients alone.
+
+        The basis is orthonormal, so the residual energy of the projection is
+        ||face - mean||^2 - ||coeffs||^2; no reconstruction is needed.
+        """
+        if buffers is None:
+            kept = np.einsum('ij,ij->i', coeffs, coeffs, dtype=np.float64)
+            return (np.maximum(energy - kept, 0) / self.dim).astype(np.float32)
+        n = len(coeffs)
+        residual = _squared_norms(coeffs, buffers.residual[:n], buffers.row)
+        np.subtract(energy, residual, out=residual)
+        np.maximum(residual, 0, out=residual)
+        return np.divide(residual, self.dim, out=buffers.errors[:n], casting='same_kind')
+
+    def decode(self, coeffs, buffers=None):
+        """B x k' coefficients (k' <= k, a prefix) -> B x h x w uint8 faces."""
+        coeffs = np.asarray(coeffs, dtype=np.float32).reshape(-1, np.shape(coeffs)[-1])
+        if buffers is None:
+            if self.blocked:
+                reconstructed = self._reconstruct(coeffs, np.empty((len(coeffs), self.dim), dtype=np.float32))
+            else:
+                reconstructed = coeffs @ self.components[:coeffs.shape[1]] + self.mean
+            return np.clip(reconstructed, 0, 255).astype(np.uint8).reshape(len(coeffs), *self.shape)
+        n = len(coeffs)
+        reconstructed = self._reconstruct(coeffs, buffers.reconstructed[:n], buffers)
+        np.clip(reconstructed, 0, 255, out=reconstructed)
+        decoded = buffers.decoded[:n]
+        np.copyto(decoded.reshape(n, self.dim), reconstructed, casting='unsafe')  # Truncates like astype
+        return decoded
+
+    def encode_decode(self, faces, buffers=None):
+        """Round-trip a batch; returns (coeffs, reconstructions, per-face MSE)."""
+        coeffs = self.encode(faces, buffers=buffers)
+        reconstructed = self.decode(coeffs, buffers)
+        if buffers is None:
+            diff = np.asarray(faces, dtype=np.float32).reshape(-1, self.dim) - reconstructed.reshape(-1, self.dim)
+            errors = np.mean(diff * diff, axis=1)
+            return coeffs, reconstructed, errors
+        n = len(coeffs)
+        diff, decoded = buffers.reconstructed[:n], buffers.centered[:n]  # Both free again after decode
+        np.copyto(diff, np.reshape(faces, (n, self.dim)))
+        np.copyto(decoded, reconstructed.reshape(n, self.dim))
+        diff -= decoded
+        errors = np.einsum('ij,ij->i', diff, diff, out=buffers.errors[:n])
+        errors /= self.dim
+        return coeffs, reconstructed, errors
+
+    def encode_with_errors(self, faces, exact=False, buffers=None):
+        """Encode a batch and report per-face MSE; returns (coeffs, errors).
+
+        By default the error is the coefficient-space estimate (no decode).
+        exact=True falls back to a real clipped reconstruction.
+        """
+        if exact:
+            coeffs, _, errors = self.encode_decode(faces, buffers)
+            return coeffs, errors
+        coeffs, energy = self.encode(faces, return_energy=True, buffers=buffers)
+        return coeffs, self.estimate_errors(energy, coeffs, buffers)
+
+
+class CodecBuffers:
+    """Every per-frame array of the codec for up to max_faces faces, allocated once.
+
+    Pass it as buffers= to crop_faces (out=buffers.faces) and the codec
+    methods; their results are then views into these arrays and stay valid
+    only until the same buffers are used for the next frame. Give every
+    thread (pipeline stage) its own buffers.
+    """
+
+    def __init__(self, codec, max_faces=MAX_FACES):
+        height, width = codec.shape
+        self.faces = np.empty((max_faces, height, width), dtype=np.uint8)
+        self.centered = np.empty((max_faces, codec.dim), dtype=np.float32)
+        self.coeffs = np.empty((max_faces, codec.k), dtype=np.float32)
+        self.energy = np.empty(max_faces, dtype=np.float64)
+        self.residual = np.empty(max_faces, dtype=np.float64)
+        self.row = np.empty(codec.dim, dtype=np.float64)  # float64 scratch for energy sums
+        self.reconstructed = np.empty((max_faces, codec.dim), dtype=np.float32)
+        self.decoded = np.empty((max_faces, height, width), dtype=np.uint8)
+        self.errors = np.empty(max_faces, dtype=np.float32)
+        # Dequantization scratch for int8 bases
+        self.block = self.block_coeffs = self.partial = None
+        if codec.blocked:
+            self.block = np.empty((COMPONENT_BLOCK, codec.dim), dtype=np.float32)
+            self.block_coeffs = np.empty((max_faces, COMPONENT_BLOCK), dtype=np.float32)
+            self.partial = np.empty((max_faces, codec.dim), dtype=np.float32)
+
+
+if __name__ == "__main__":
+    from basis import open_basis
+
+    parser = argparse.ArgumentParser(description="Per-frame allocations and latency of the codec path, with and without CodecBuffers")
+    parser.add_argument('basis', help="Eigenbasis (.efb)")
+    parser.add_argument('faces', help="uint8 N x 120 x 120 face tensor, e.g. dataset.py's faces.npy")
+    parser.add_argument('--k', type=int, default=700)
+    parser.add_argument('--frames', type=int, default=500)
+
+    args = parser.parse_args()
+
+    codec = EigenfaceCodec(open_basis(args.basis, args.k))
+    faces = np.load(args.faces, mmap_mode='r')
+    gray = np.ascontiguousarray(np.tile(faces[0], (4, 4)))  # Stand-in frame with one face box
+    boxes = np.array([[0, 0, 240, 240]], dtype=np.int32)
+
+    # The preview scripts round-trip every face; server.py encodes and estimates the error from energy
+    paths = {
+        "encode_decode": lambda crops, buffers: codec.encode_decode(crops, buffers),
+        "encode+estimate_errors": lambda crops, buffers: codec.encode_with_errors(crops, buffers=buffers),
+    }
+    for name, path in paths.items():
+        for buffers in (None, CodecBuffers(codec)):
+            out = None if buffers is None else buffers.faces
+            path(crop_faces(gray, boxes, out=out)[0], buffers)  # Warm-up
+            times = []
+            tracemalloc.start()
+            for _ in range(args.frames):
+                start = time.perf_counter()
+                crops, _, _ = crop_faces(gray, boxes, out=out)
+                path(crops, buffers)
+                times.append(time.perf_counter() - start)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"{name}, {'buffers' if buffers is not None else 'fresh arrays'}: peak traced {peak / 1024:.1f} KiB, "
+                  f"p50 {np.percentile(times, 50) * 1e3:.3f} ms, p99 {np.percentile(times, 99) * 1e3:.3f} ms")
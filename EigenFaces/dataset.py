@@ -0,0 +1,152 @@
+import argparse
+import json
+import os
+from multiprocessing import Pool
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+###################################### VARIABLES ######################################
+
+target_dim = (120, 120)  # Eigenface resolution (width, height)
+
+TENSOR_FILE = "faces.npy"  # uint8, N x height x width
+MANIFEST_FILE = "manifest.json"  # Source path, class, mtime and size for every row (and every undecodable file)
+
+########################################################################################
+
+
+def is_image_file(filename):
+    extensions = ('.jpg', '.jpeg', '.png', '.bmp', '.gif')
+    return filename.lower().endswith(extensions)
+
+
+def list_images_by_class(base_dir):
+    """Map every class sub-directory of base_dir to the image paths it contains."""
+    data = {}
+    for class_name in sorted(os.listdir(base_dir)):
+        class_path = os.path.join(base_dir, class_name)
+        if os.path.isdir(class_path):
+            data[class_name] = [os.path.join(class_path, file)
+                                for file in sorted(os.listdir(class_path)) if is_image_file(file)]
+    return data
+
+
+def decode_image(path, dim=target_dim):
+    """Read an image as grayscale and resize it to dim; None if it cannot be decoded."""
+    img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return None
+    return cv2.resize(img, dim)
+
+
+def _decode_worker(args):
+    path, dim = args
+    return decode_image(path, dim)
+
+
+def _scan(base_dir):
+    entries = []
+    for class_name, paths in list_images_by_class(base_dir).items():
+        for path in paths:
+            stat = os.stat(path)
+            entries.append({"path": os.path.abspath(path), "class": class_name,
+                            "mtime": stat.st_mtime_ns, "size": stat.st_size})
+    return entries
+
+
+def _key(entry):
+    return entry["path"], entry["mtime"], entry["size"]
+
+
+def _read_manifest(cache_dir, dim):
+    manifest_path = os.path.join(cache_dir, MANIFEST_FILE)
+    tensor_path = os.path.join(cache_dir, TENSOR_FILE)
+    if not (os.path.exists(manifest_path) and os.path.exists(tensor_path)):
+        return None
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if tuple(manifest.get("dim", ())) != tuple(dim):
+        return None  # Resolution changed, everything has to be redone
+    return manifest
+
+
+def prepare_dataset(base_dir, cache_dir, workers=None, dim=target_dim):
+    """Decode base_dir into cache_dir/faces.npy, reprocessing only new or changed images.
+
+    Rows of the tensor line up with manifest["entries"]. Unchanged images
+    (same path, mtime and size) are copied over from the previous tensor;
+    everything else is decoded and resized by a pool of workers. Files that
+    fail to decode are listed in manifest["failed"] and skipped until they
+    change.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    tensor_path = os.path.join(cache_dir, TENSOR_FILE)
+    entries = _scan(base_dir)
+
+    old = _read_manifest(cache_dir, dim)
+    old_rows, old_failed = {}, set()
+    if old is not None:
+        old_rows = {_key(e): row for row, e in enumerate(old["entries"])}
+        old_failed = {_key(e) for e in old.get("failed", [])}
+        keys = [_key(e) for e in entries]
+        if [key for key in keys if key not in old_failed] == [_key(e) for e in old["entries"]] and \
+                old_failed <= set(keys):
+            print(f"Dataset cache is up to date ({len(old_rows)} images, {len(old_failed)} unreadable skipped)")
+            return load_dataset(cache_dir)
+
+    stale = [i for i, e in enumerate(entries) if _key(e) not in old_rows and _key(e) not in old_failed]
+    skipped = sum(_key(e) in old_failed for e in entries)
+    print(f"{len(entries) - len(stale) - skipped} cached images reused, {skipped} unreadable skipped, "
+          f"{len(stale)} to decode")
+
+    decoded = {}
+    if stale:
+        with Pool(workers) as pool:
+            jobs = ((entries[i]["path"], dim) for i in stale)
+            results = pool.imap(_decode_worker, jobs, chunksize=64)
+            for i, img in zip(stale, tqdm(results, total=len(stale))):
+                if img is None:
+                    print(f"Warning: Could not load image: {entries[i]['path']}")
+                else:
+                    decoded[i] = img
+
+    kept = [i for i, e in enumerate(entries) if i in decoded or _key(e) in old_rows]
+    failed = [e for i, e in enumerate(entries) if i not in decoded and _key(e) not in old_rows]
+    previous = np.load(tensor_path, mmap_mode='r') if old_rows else None
+
+    tmp_path = tensor_path + ".tmp"
+    tensor = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8, shape=(len(kept), dim[1], dim[0]))
+    for row, i in enumerate(kept):
+        e = entries[i]
+        tensor[row] = decoded[i] if i in decoded else previous[old_rows[_key(e)]]
+    tensor.flush()
+    del tensor, previous
+
+    os.replace(tmp_path, tensor_path)
+    manifest = {"dim": list(dim), "entries": [entries[i] for i in kept], "failed": failed}
+    with open(os.path.join(cache_dir, MANIFEST_FILE) + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(os.path.join(cache_dir, MANIFEST_FILE) + ".tmp", os.path.join(cache_dir, MANIFEST_FILE))
+    return load_dataset(cache_dir)
+
+
+def load_dataset(cache_dir):
+    """Memory-map a prepared dataset; returns (faces, manifest)."""
+    faces = np.load(os.path.join(cache_dir, TENSOR_FILE), mmap_mode='r')
+    with open(os.path.join(cache_dir, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    return faces, manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Decode a face dataset into a cached uint8 tensor")
+    parser.add_argument('data_path', help="Directory with one sub-directory of images per class")
+    parser.add_argument('cache_dir', help="Where faces.npy and manifest.json are kept")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+
+    args = parser.parse_args()
+
+    faces, manifest = prepare_dataset(args.data_path, args.cache_dir, args.workers)
+    print(f"{faces.shape[0]} faces cached in {args.cache_dir}")
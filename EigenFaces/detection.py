@@ -0,0 +1,253 @@
+"""Face detector backends, and detection on a downscaled frame or a search window around the last faces.
+
+make_detector builds a detector(image) -> N x 4 int32 xyxy boxes callable for
+one of BACKENDS: the ultralytics PyTorch model, or the same weights exported
+once to ONNX and run on ONNX Runtime or OpenCV DNN.
+
+Faces are cropped to 120 x 120 anyway, so the detector rarely needs the full
+webcam resolution. RegionDetector feeds it a copy shrunk by DETECTION_SCALE,
+or, once faces are known, just the window around them, and maps the boxes it
+finds back to full-resolution coordinates for cropping. Detector cost scales
+with the input area, so a scale of 0.5 costs about a quarter of a full-size
+pass.
+"""
+import argparse
+import math
+import os
+import time
+
+import cv2
+import numpy as np
+
+from codec import face_boxes
+
+###################################### VARIABLES ######################################
+
+DETECTION_SCALE = 0.5  # Full-frame searches run on a copy this much smaller
+ROI_MARGIN = 1.0  # Search window padding around the last faces, as a fraction of their size
+ROI_MAX_SIDE = 320  # Search windows are shrunk to at most this many pixels on the long side
+FULL_SEARCH_INTERVAL = 10  # Detector calls between full-frame searches (to pick up new faces)
+MODEL_STRIDE = 32  # YOLO input sizes must be multiples of this
+
+WEIGHTS = "./yolov8n-face-lindevs.pt"
+BACKENDS = ("ultralytics", "onnxruntime", "opencv")
+DETECTOR_BACKEND = "ultralytics"
+ONNX_INPUT_SIZE = 640  # Largest input the ONNX backends feed the model
+NUM_CLASSES = 1
+CONFIDENCE = 0.25
+NMS_IOU = 0.45
+
+########################################################################################
+
+
+class UltralyticsDetector:
+    """detector(image) -> N x 4 int32 xyxy boxes through the ultralytics PyTorch model.
+
+    The model is run at the image's own size instead of its default 640, so
+    smaller inputs really are cheaper.
+    """
+
+    def __init__(self, weights=WEIGHTS):
+        from ultralytics import YOLO
+        self.model = YOLO(weights)
+
+    def __call__(self, image):
+        size = MODEL_STRIDE * math.ceil(max(image.shape[:2]) / MODEL_STRIDE)
+        return face_boxes(self.model(image, imgsz=size, verbose=False))
+
+
+def export_onnx(weights=WEIGHTS, onnx_path=None):
+    """Export the face model to ONNX once (dynamic input size); returns the .onnx path.
+
+    The export is reused until the weights file is newer than it.
+    """
+    onnx_path = onnx_path or os.path.splitext(weights)[0] + ".onnx"
+    if os.path.exists(onnx_path) and os.path.getmtime(onnx_path) >= os.path.getmtime(weights):
+        return onnx_path
+    from ultralytics import YOLO
+    exported = YOLO(weights).export(format="onnx", dynamic=True, imgsz=ONNX_INPUT_SIZE)
+    if os.path.abspath(exported) != os.path.abspath(onnx_path):
+        os.replace(exported, onnx_path)
+    print(f"Exported {weights} to {onnx_path}")
+    return onnx_path
+
+
+def letterbox(image, size):
+    """Resize keeping the aspect ratio and pad to size x size; returns (padded, ratio, (pad_x, pad_y))."""
+    h, w = image.shape[:2]
+    ratio = min(size / h, size / w)
+    new_w, new_h = round(w * ratio), round(h * ratio)
+    pad_x, pad_y = (size - new_w) // 2, (size - new_h) // 2
+    resized = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR) if ratio != 1 else image
+    padded = cv2.copyMakeBorder(resized, pad_y, size - new_h - pad_y, pad_x, size - new_w - pad_x,
+                                cv2.BORDER_CONSTANT, value=(114, 114, 114))
+    return padded, ratio, (pad_x, pad_y)
+
+
+def decode_predictions(output, ratio, pad, conf=CONFIDENCE, iou=NMS_IOU):
+    """Raw YOLOv8 output (1 x (4 + classes [+ keypoints]) x anchors) -> N x 4 int32 xyxy boxes after NMS."""
+    predictions = output[0].T
+    scores = predictions[:, 4:4 + NUM_CLASSES].max(axis=1)
+    keep = scores > conf
+    predictions, scores = predictions[keep], scores[keep]
+    if not len(scores):
+        return np.zeros((0, 4), dtype=np.int32)
+
+    # (cx, cy, w, h) in letterboxed pixels -> (x, y, w, h) in image pixels
+    xywh = predictions[:, :4].copy()
+    xywh[:, :2] -= xywh[:, 2:] / 2 + np.asarray(pad)
+    xywh /= ratio
+    indices = np.asarray(cv2.dnn.NMSBoxes(xywh.tolist(), scores.tolist(), conf, iou), dtype=np.int64).reshape(-1)
+    boxes = xywh[indices]
+    boxes[:, 2:] += boxes[:, :2]
+    return boxes.astype(np.int32)
+
+
+class OnnxDetector:
+    """detector(image) -> boxes through the exported ONNX model on a CPU runtime.
+
+    runtime is "onnxruntime" or "opencv" (cv2.dnn). The session is created
+    and warmed up once in the constructor; each call only letterboxes,
+    runs the session and does NMS in numpy/OpenCV, without any of the
+    ultralytics per-call overhead. Inputs are letterboxed to their own
+    stride-rounded size (capped at ONNX_INPUT_SIZE), which the dynamic export
+    allows.
+    """
+
+    def __init__(self, onnx_path, runtime="onnxruntime", threads=0):
+        self.runtime = runtime
+        if runtime == "onnxruntime":
+            import onnxruntime
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = threads
+            options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            self.session = onnxruntime.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+            self.input_name = self.session.get_inputs()[0].name
+        elif runtime == "opencv":
+            self.net = cv2.dnn.readNetFromONNX(onnx_path)
+            self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        else:
+            raise ValueError(f"Unknown ONNX runtime {runtime!r}")
+        self(np.zeros((ONNX_INPUT_SIZE, ONNX_INPUT_SIZE, 3), dtype=np.uint8))  # Warm-up: allocate and plan once
+
+    def _run(self, blob):
+        if self.runtime == "onnxruntime":
+            return self.session.run(None, {self.input_name: blob})[0]
+        self.net.setInput(blob)
+        return self.net.forward()
+
+    def __call__(self, image):
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        size = min(MODEL_STRIDE * math.ceil(max(image.shape[:2]) / MODEL_STRIDE), ONNX_INPUT_SIZE)
+        padded, ratio, pad = letterbox(image, size)
+        blob = cv2.dnn.blobFromImage(padded, 1 / 255.0, swapRB=True)  # BGR HWC uint8 -> RGB NCHW float32
+        return decode_predictions(self._run(blob), ratio, pad)
+
+
+def make_detector(backend=DETECTOR_BACKEND, weights=WEIGHTS):
+    """Detector for one of BACKENDS; the ONNX backends export the weights on first use."""
+    if backend == "ultralytics":
+        return UltralyticsDetector(weights)
+    if backend in ("onnxruntime", "opencv"):
+        return OnnxDetector(export_onnx(weights), runtime=backend)
+    raise ValueError(f"Unknown detector backend {backend!r}, expected one of {BACKENDS}")
+
+
+def remap_boxes(boxes, scale, origin, shape):
+    """Boxes found in a region scaled by scale whose top-left corner is origin -> frame coordinates."""
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4) / scale
+    boxes += np.tile(np.asarray(origin, dtype=np.float32), 2)
+    h, w = shape[:2]
+    return np.round(np.clip(boxes, 0, [w, h, w, h])).astype(np.int32)
+
+
+class RegionDetector:
+    """Wraps detector(image) -> boxes to search a downscaled frame or the window around the last faces.
+
+    Falls back to a full-frame search on the same frame when the window comes
+    up empty, and searches the full frame every full_search_interval calls so
+    faces entering elsewhere are found too.
+    """
+
+    def __init__(self, detector, scale=DETECTION_SCALE, roi_margin=ROI_MARGIN, roi_max_side=ROI_MAX_SIDE,
+                 full_search_interval=FULL_SEARCH_INTERVAL):
+        self.detector = detector
+        self.scale = scale
+        self.roi_margin = roi_margin
+        self.roi_max_side = roi_max_side
+        self.full_search_interval = full_search_interval
+        self.last_boxes = None
+        self.calls_since_full_search = 0
+
+    def _detect(self, image, scale, origin, shape):
+        if scale != 1:
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        return remap_boxes(self.detector(image), scale, origin, shape)
+
+    def _search_window(self, shape):
+        """(x1, y1, x2, y2) around the last faces, or None if there are none."""
+        if self.last_boxes is None or not len(self.last_boxes):
+            return None
+        x1, y1 = self.last_boxes[:, :2].min(axis=0)
+        x2, y2 = self.last_boxes[:, 2:].max(axis=0)
+        pad_x, pad_y = self.roi_margin * (x2 - x1), self.roi_margin * (y2 - y1)
+        h, w = shape[:2]
+        return (int(max(x1 - pad_x, 0)), int(max(y1 - pad_y, 0)),
+                int(min(x2 + pad_x, w)), int(min(y2 + pad_y, h)))
+
+    def __call__(self, frame):
+        """N x 4 int32 xyxy boxes in full-frame coordinates."""
+        window = self._search_window(frame.shape)
+        boxes = None
+        if window is not None and self.calls_since_full_search < self.full_search_interval:
+            x1, y1, x2, y2 = window
+            scale = min(1.0, self.roi_max_side / max(x2 - x1, y2 - y1, 1))
+            boxes = self._detect(frame[y1:y2, x1:x2], scale, (x1, y1), frame.shape)
+            self.calls_since_full_search += 1
+
+        if boxes is None or not len(boxes):  # No faces known, window came up empty, or time for a full search
+            boxes = self._detect(frame, self.scale, (0, 0), frame.shape)
+            self.calls_since_full_search = 0
+
+        self.last_boxes = boxes
+        return boxes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark detector backends on the same recorded input")
+    parser.add_argument('video', help="Recorded video file")
+    parser.add_argument('--backends', nargs='+', default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument('--weights', default=WEIGHTS)
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--scale', type=float, default=1.0, help="Downscale frames before detection")
+
+    args = parser.parse_args()
+
+    # Decode up front so every backend sees identical frames and decoding isn't timed
+    cap = cv2.VideoCapture(args.video)
+    frames = []
+    while len(frames) < args.frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(cv2.resize(frame, None, fx=args.scale, fy=args.scale) if args.scale != 1 else frame)
+    cap.release()
+    if not frames:
+        raise SystemExit(f"No frames read from {args.video}")
+
+    for backend in args.backends:
+        start = time.perf_counter()
+        detector = make_detector(backend, args.weights)
+        load_time = time.perf_counter() - start
+        for frame in frames[:args.warmup]:
+            detector(frame)
+        faces = 0
+        start = time.perf_counter()
+        for frame in frames:
+            faces += len(detector(frame))
+        elapsed = time.perf_counter() - start
+        print(f"{backend}: {len(frames) / elapsed:.1f} fps over {len(frames)} frames "
+              f"({faces} faces, load {load_time:.2f}s)")
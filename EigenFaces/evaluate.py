@@ -0,0 +1,221 @@
+"""Rate-distortion sweep: reconstruction quality for every k = 1..K from a single projection.
+
+The basis is orthonormal, so the squared error of keeping the first k
+coefficients is ||face - mean||^2 minus the cumulative energy of those
+coefficients (ratecontrol.prefix_mse). Projecting a held-out face set once
+onto the full basis therefore gives the whole MSE/PSNR curve with one GEMM
+and a cumulative sum, rather than K reconstructions. The result also holds
+the eigenvalue spectrum and the variance each component captures on the
+held-out faces, and the smallest k meeting a quality bar.
+
+    python evaluate.py eigen_faces.efb holdout/faces.npy --target_psnr 32 -o rd_curve.json
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from basis import open_basis
+from codec import CodecBuffers, EigenfaceCodec
+from ratecontrol import prefix_mse, psnr_to_mse, TARGET_PSNR
+
+###################################### VARIABLES ######################################
+
+CHUNK_SIZE = 500  # Faces projected at a time
+TARGET_COVERAGE = 0.9  # Fraction of faces that must reach the target PSNR
+COMPARE_KS = (50, 100, 200, 400, 700, 1000)  # Prefix lengths compare_bases reconstructs at
+TIMING_FRAMES = 50  # Single-face encode/decode round trips timed per basis
+
+########################################################################################
+
+
+def mse_to_psnr(mse):
+    return 10 * np.log10(255.0 ** 2 / np.maximum(mse, 1e-10))
+
+
+def rate_distortion(basis, faces, target_psnr=TARGET_PSNR, chunk_size=CHUNK_SIZE):
+    """Sweep k over the whole basis on faces (N x h x w uint8, e.g. a memory-mapped dataset tensor).
+
+    Returns a dict of length-K arrays indexed by k - 1: mse (mean over faces),
+    psnr (of that mean MSE), mean_psnr (average per-face PSNR), coverage
+    (fraction of faces at or above target_psnr), captured (fraction of the
+    held-out variance the first k components explain), heldout_variance
+    (per-component variance on the faces) and eigen_values (training
+    variance, when the basis stores it).
+    """
+    codec = EigenfaceCodec(basis)
+    target_mse = psnr_to_mse(target_psnr)
+    count = 0
+    total_energy = 0.0
+    mse_sum = np.zeros(codec.k)
+    psnr_sum = np.zeros(codec.k)
+    covered = np.zeros(codec.k, dtype=np.int64)
+    component_energy = np.zeros(codec.k)
+    for start in range(0, len(faces), chunk_size):
+        chunk = np.asarray(faces[start:start + chunk_size])
+        coeffs, energy = codec.encode(chunk, return_energy=True)
+        mse = np.maximum(prefix_mse(coeffs, energy, codec.dim), 0)  # B x K, column k - 1
+        count += len(chunk)
+        total_energy += energy.sum()
+        mse_sum += mse.sum(axis=0)
+        psnr_sum += mse_to_psnr(mse).sum(axis=0)
+        covered += (mse <= target_mse).sum(axis=0)
+        component_energy += np.einsum('ij,ij->j', coeffs, coeffs, dtype=np.float64)
+    if count == 0:
+        raise ValueError("No faces to evaluate")
+
+    mse = mse_sum / count
+    return {
+        "k": np.arange(1, codec.k + 1),
+        "mse": mse,
+        "psnr": mse_to_psnr(mse),
+        "mean_psnr": psnr_sum / count,
+        "coverage": covered / count,
+        "captured": np.cumsum(component_energy) / total_energy,
+        "heldout_variance": component_energy / count,
+        "eigen_values": None if basis.eigen_values is None else np.asarray(basis.eigen_values, dtype=np.float64),
+        "faces": count,
+        "target_psnr": target_psnr,
+    }
+
+
+def smallest_k(curve, target_psnr=None, coverage=TARGET_COVERAGE):
+    """Fewest components whose mean-MSE PSNR reaches target_psnr (default: the sweep's) and that
+    bring at least coverage of the faces to the sweep's target; None if no k does."""
+    target_psnr = curve["target_psnr"] if target_psnr is None else target_psnr
+    meets = (curve["psnr"] >= target_psnr) & (curve["coverage"] >= coverage)
+    return int(np.argmax(meets)) + 1 if meets.any() else None
+
+
+def save_curve(curve, path, coverage=TARGET_COVERAGE):
+    """Write the sweep (and the chosen k) as JSON."""
+    data = {key: value.tolist() if isinstance(value, np.ndarray) else value for key, value in curve.items()}
+    data["coverage_target"] = coverage
+    data["chosen_k"] = smallest_k(curve, coverage=coverage)
+    with open(path, "w") as f:
+        json.dump(data, f)
+
+
+def summarize(curve, coverage=TARGET_COVERAGE, ks=(50, 100, 200, 400, 700, 1000)):
+    lines = [f"{curve['faces']} faces, K = {len(curve['k'])}"]
+    for k in ks:
+        if k <= len(curve["k"]):
+            i = k - 1
+            lines.append(f"k={k:5d}: PSNR {curve['psnr'][i]:.2f} dB (mean per face {curve['mean_psnr'][i]:.2f}), "
+                         f"{curve['coverage'][i] * 100:.1f}% of faces >= {curve['target_psnr']} dB, "
+                         f"{curve['captured'][i] * 100:.1f}% of variance")
+    k = smallest_k(curve, coverage=coverage)
+    lines.append(f"Smallest k for {curve['target_psnr']} dB on {coverage * 100:.0f}% of faces: "
+                 f"{k if k is not None else 'not reached'}")
+    return "\n".join(lines)
+
+
+def compare_bases(reference, candidate, faces, ks=COMPARE_KS, chunk_size=CHUNK_SIZE):
+    """Accuracy and speed of a float16/int8 basis against the float32 one it was converted from.
+
+    Reconstructions are clipped uint8 decodes, as on the live path, so the
+    PSNR drop per k is what a viewer would get. Returns a dict with the
+    per-k PSNRs, the relative RMS error of the coefficients, the largest
+    eigenface weight error, the stored component bytes and p50 round-trip
+    milliseconds for one face.
+    """
+    codecs = EigenfaceCodec(reference), EigenfaceCodec(candidate)
+    ks = [k for k in ks if k <= min(codec.k for codec in codecs)] or [min(codec.k for codec in codecs)]
+    squared_errors = np.zeros((2, len(ks)))
+    coeff_error = coeff_energy = 0.0
+    count = 0
+    for start in range(0, len(faces), chunk_size):
+        chunk = np.asarray(faces[start:start + chunk_size])
+        pixels = chunk.reshape(len(chunk), -1).astype(np.float32)
+        coeffs = [codec.encode(chunk) for codec in codecs]
+        coeff_error += np.sum((coeffs[1] - coeffs[0]) ** 2, dtype=np.float64)
+        coeff_energy += np.sum(coeffs[0] ** 2, dtype=np.float64)
+        for i, (codec, codec_coeffs) in enumerate(zip(codecs, coeffs)):
+            for j, k in enumerate(ks):
+                diff = pixels - codec.decode(codec_coeffs[:, :k]).reshape(len(chunk), -1)
+                squared_errors[i, j] += np.sum(diff * diff, dtype=np.float64)
+        count += len(chunk)
+    if count == 0:
+        raise ValueError("No faces to evaluate")
+    psnr = mse_to_psnr(squared_errors / (count * codecs[0].dim))
+
+    weights = np.asarray(candidate.components, dtype=np.float32)
+    if candidate.scales is not None:
+        weights = weights * np.asarray(candidate.scales)[:, None]
+    timings = []
+    for codec in codecs:
+        buffers = CodecBuffers(codec, max_faces=1)
+        times = []
+        for _ in range(TIMING_FRAMES):
+            start = time.perf_counter()
+            codec.encode_decode(faces[:1], buffers)
+            times.append(time.perf_counter() - start)
+        timings.append(float(np.percentile(times, 50)) * 1000)
+    return {
+        "k": ks,
+        "reference_psnr": psnr[0],
+        "psnr": psnr[1],
+        "coefficient_error": float(np.sqrt(coeff_error / max(coeff_energy, 1e-12))),
+        "max_weight_error": float(np.abs(weights - reference.components[:len(weights)]).max()),
+        "bytes": (reference.components.nbytes, candidate.components.nbytes),
+        "round_trip_ms": tuple(timings),
+    }
+
+
+def summarize_comparison(report, dtype):
+    lines = [f"float32 {report['bytes'][0] / 2 ** 20:.1f} MB -> {dtype} {report['bytes'][1] / 2 ** 20:.1f} MB, "
+             f"relative coefficient error {report['coefficient_error']:.2e}, "
+             f"max weight error {report['max_weight_error']:.2e}"]
+    for k, reference, candidate in zip(report["k"], report["reference_psnr"], report["psnr"]):
+        lines.append(f"k={k:5d}: {reference:.3f} dB -> {candidate:.3f} dB ({candidate - reference:+.3f})")
+    lines.append(f"One-face encode+decode p50: {report['round_trip_ms'][0]:.2f} ms float32, "
+                 f"{report['round_trip_ms'][1]:.2f} ms {dtype}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="One-pass rate-distortion sweep of an eigenbasis over a held-out face set")
+    parser.add_argument('basis', help="Eigenbasis (.efb)")
+    parser.add_argument('faces', help="Held-out uint8 N x 120 x 120 face tensor (dataset.py)")
+    parser.add_argument('--target_psnr', type=float, default=TARGET_PSNR)
+    parser.add_argument('--coverage', type=float, default=TARGET_COVERAGE)
+    parser.add_argument('--chunk_size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('-o', '--output', help="Write the curve and spectrum as JSON")
+    parser.add_argument('--plot', help="Save PSNR and spectrum plots to this image (needs matplotlib)")
+    parser.add_argument('--compare', metavar='EFB', help="Instead of the sweep, report the accuracy loss of this "
+                                                         "float16/int8 conversion of basis (basis.py --dtype)")
+
+    args = parser.parse_args()
+
+    if args.compare:
+        faces = np.load(args.faces, mmap_mode='r')
+        candidate = open_basis(args.compare)
+        report = compare_bases(open_basis(args.basis, candidate.k), candidate, faces, chunk_size=args.chunk_size)
+        print(summarize_comparison(report, candidate.components.dtype))
+        raise SystemExit
+
+    curve = rate_distortion(open_basis(args.basis), np.load(args.faces, mmap_mode='r'), args.target_psnr,
+                            args.chunk_size)
+    print(summarize(curve, args.coverage))
+    if args.output:
+        save_curve(curve, args.output, args.coverage)
+    if args.plot:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+
+        fig, (quality, spectrum) = plt.subplots(1, 2, figsize=(12, 4.5))
+        quality.plot(curve["k"], curve["psnr"], label="PSNR of mean MSE")
+        quality.plot(curve["k"], curve["mean_psnr"], label="Mean per-face PSNR")
+        quality.axhline(args.target_psnr, color="gray", linestyle="--")
+        quality.set_xlabel("k")
+        quality.set_ylabel("dB")
+        quality.legend()
+        if curve["eigen_values"] is not None:
+            spectrum.semilogy(curve["k"], curve["eigen_values"], label="Eigenvalues (training)")
+        spectrum.semilogy(curve["k"], curve["heldout_variance"], label="Held-out variance")
+        spectrum.set_xlabel("Component")
+        spectrum.legend()
+        fig.tight_layout()
+        fig.savefig(args.plot)
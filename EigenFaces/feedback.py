@@ -0,0 +1,158 @@
+"""Receiver reports and sender-side congestion control for the call (see PROTOCOL.md)."""
+import time
+from collections import deque, namedtuple
+
+from protocol import seq_newer, stream_restarted
+
+###################################### VARIABLES ######################################
+
+PING_INTERVAL = 0.5  # Seconds between RTT probes
+REPORT_INTERVAL = 0.5  # Seconds between receiver reports
+FEEDBACK_TIMEOUT = 2.0  # No report for this long: assume the link is gone and back off
+
+LOSS_THRESHOLD = 0.05  # Fraction of datagrams lost that counts as congestion
+QUEUE_DELAY = 0.05  # Seconds of RTT above the minimum that count as a standing queue
+DECREASE_FACTOR = 0.7  # Multiplicative decrease on congestion
+INCREASE_FACTOR = 1.1  # Multiplicative increase per clean report
+SLOW_START_FACTOR = 2.0  # Increase per clean report until the first congestion signal
+RTT_SMOOTHING = 0.125  # EWMA weight of a new RTT sample (as in TCP)
+MIN_RTT_WINDOW = 10.0  # Seconds of RTT samples the minimum is taken over, so it follows route changes
+
+# (quantizer ladder rung, max coefficients, max frames per second), best first.
+# Ladder rungs index quantize.BIT_BUDGET_LADDER.
+OperatingPoint = namedtuple("OperatingPoint", "level k_max fps")
+OPERATING_POINTS = (
+    OperatingPoint(0, 700, 30),
+    OperatingPoint(0, 700, 20),
+    OperatingPoint(1, 400, 20),
+    OperatingPoint(2, 256, 15),
+    OperatingPoint(3, 128, 10),
+    OperatingPoint(3, 64, 5),
+)
+
+########################################################################################
+
+
+def now_us():
+    return time.time_ns() // 1000
+
+
+def monotonic_us():
+    return time.monotonic_ns() // 1000
+
+
+class ReceiverStats:
+    """Loss and jitter of the incoming stream, summarized into periodic reports.
+
+    Loss counts datagrams: a frame announces its layer count in every
+    datagram, and a frame that never showed up (a gap in seq) counts as
+    one lost datagram. Jitter is the RFC 3550 interarrival jitter of the
+    frames' capture timestamps, so it needs no clock sync.
+    """
+
+    def __init__(self):
+        self.highest_seq = None
+        self._highest_timestamp_us = None
+        self.jitter_us = 0.0
+        self._last_transit = None
+        self._frames = {}  # seq -> layers, for frames seen in this interval
+        self._expected = 0
+        self._received = 0
+
+    def on_datagram(self, header, arrival_us=None):
+        arrival_us = now_us() if arrival_us is None else arrival_us
+        self._received += 1
+        if stream_restarted(header, self.highest_seq, self._highest_timestamp_us):
+            self.highest_seq = None  # Sender restarted: count its stream afresh, not as late frames
+            self._frames.clear()
+        if header.seq not in self._frames:
+            if self.highest_seq is None or seq_newer(header.seq, self.highest_seq):
+                if self.highest_seq is not None:
+                    self._expected += (header.seq - self.highest_seq - 1) & 0xFFFFFFFF  # Frames never seen
+                self.highest_seq = header.seq
+                self._highest_timestamp_us = header.timestamp_us
+                self._expected += header.layers
+            else:
+                self._expected += header.layers - 1  # Late frame, already counted as one lost datagram
+            self._frames[header.seq] = header.layers
+
+            transit = arrival_us - header.timestamp_us
+            if self._last_transit is not None:
+                self.jitter_us += (abs(transit - self._last_transit) - self.jitter_us) / 16
+            self._last_transit = transit
+
+    def report(self):
+        """(highest_seq, fraction_lost, jitter_us) since the last report, or None if nothing arrived.
+
+        An interval without a single datagram sends no report at all rather
+        than one of 0% loss (nothing expected was counted), so during an
+        outage the sender hits FEEDBACK_TIMEOUT and backs off.
+        """
+        if self._received == 0:
+            return None
+        fraction_lost = 1 - self._received / self._expected if self._expected else 0.0
+        self._frames.clear()
+        self._expected = self._received = 0
+        return self.highest_seq, max(fraction_lost, 0.0), self.jitter_us
+
+
+class CongestionController:
+    """AIMD on a target send rate, mapped onto a ladder of operating points.
+
+    A stream starts at the middle operating point in slow start, doubling
+    the rate (SLOW_START_FACTOR) per clean report, so a good link reaches
+    the best point within a few reports. The first congestion signal ends
+    slow start; from then on the rate drops by DECREASE_FACTOR whenever a
+    report shows loss or the smoothed RTT sits QUEUE_DELAY (plus twice the
+    jitter) above the minimum, and grows by INCREASE_FACTOR per clean
+    report. Without reports for FEEDBACK_TIMEOUT the sender falls to the
+    cheapest point and slow-starts again, so it never keeps flooding a dead
+    link. frame_bytes gives the worst-case bytes per frame of each point, so
+    point rates are frame_bytes * fps.
+    """
+
+    def __init__(self, frame_bytes, points=OPERATING_POINTS):
+        self.points = points
+        self.rates = [size * point.fps for size, point in zip(frame_bytes, points)]
+        self.rate = self.rates[len(self.rates) // 2]
+        self.slow_start = True
+        self.srtt = None
+        self.min_rtt = None
+        self._rtt_samples = deque()  # (monotonic seconds, rtt) within MIN_RTT_WINDOW
+        self.last_report = None
+
+    def on_pong(self, timestamp_us):
+        """RTT sample from a pong echoing our ping's (monotonic, see protocol.pack_ping) timestamp; returns it in seconds.
+
+        min_rtt is the smallest sample of the last MIN_RTT_WINDOW seconds, so
+        after a route change the queueing test compares against the new path.
+        """
+        now = time.monotonic()
+        rtt = max(monotonic_us() - timestamp_us, 0) / 1e6
+        self._rtt_samples.append((now, rtt))
+        while self._rtt_samples[0][0] < now - MIN_RTT_WINDOW:
+            self._rtt_samples.popleft()
+        self.min_rtt = min(sample for _, sample in self._rtt_samples)
+        self.srtt = rtt if self.srtt is None else self.srtt + RTT_SMOOTHING * (rtt - self.srtt)
+        return rtt
+
+    def on_report(self, fraction_lost, jitter_us):
+        self.last_report = time.monotonic()
+        queued = self.srtt is not None and self.srtt - self.min_rtt > QUEUE_DELAY + 2 * jitter_us / 1e6
+        if fraction_lost > LOSS_THRESHOLD or queued:
+            self.rate = max(self.rate * DECREASE_FACTOR, self.rates[-1])
+            self.slow_start = False
+        else:
+            factor = SLOW_START_FACTOR if self.slow_start else INCREASE_FACTOR
+            self.rate = min(self.rate * factor, self.rates[0])
+
+    def operating_point(self):
+        """Best point whose rate fits the current target."""
+        if self.last_report is not None and time.monotonic() - self.last_report > FEEDBACK_TIMEOUT:
+            self.rate = self.rates[-1]
+            self.slow_start = True
+            self.last_report = None
+        for rate, point in zip(self.rates, self.points):
+            if rate <= self.rate:
+                return point
+        return self.points[-1]
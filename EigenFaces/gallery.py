@@ -0,0 +1,176 @@
+"""Face identification by nearest-neighbour search over eigenface coefficients.
+
+A Gallery holds one L2-normalized vector of leading PCA coefficients per
+enrolled face, in a single contiguous float32 matrix. Searching a batch of
+live faces (whose coefficients the codec computed anyway) is one BLAS
+product of the normalized queries with that matrix, i.e. cosine similarity,
+then an argpartition for the top k. The matrix is stored k x N (one row per
+coefficient) so a single query streams it as one GEMV over contiguous rows;
+at k = 100 that is a 400-byte read per enrolled face and stays around a
+millisecond for tens of thousands of them (see the bench command).
+
+    python gallery.py enroll eigen_faces.efb face_dataset gallery.npz
+    python gallery.py bench eigen_faces.efb --size 50000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from dataset import decode_image, list_images_by_class
+
+###################################### VARIABLES ######################################
+
+GALLERY_K = 100  # Leading coefficients compared; later ones mostly carry noise
+TOP_K = 5
+MATCH_THRESHOLD = 0.8  # Cosine similarity below which a face is reported as unknown
+ENROLL_BATCH = 256  # Images projected at a time when enrolling a directory
+
+########################################################################################
+
+
+def normalize(vectors):
+    """Rows scaled to unit L2 norm (float32, all-zero rows stay zero)."""
+    vectors = np.array(vectors, dtype=np.float32, ndmin=2)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=vectors, where=norms > 0)
+
+
+class Gallery:
+    """Enrolled coefficient vectors and the name each belongs to.
+
+    Vectors are kept as the columns of a preallocated k x capacity matrix
+    that doubles when full, so enrolling one face at a time stays cheap and
+    search always runs on contiguous rows.
+    """
+
+    def __init__(self, k=GALLERY_K, capacity=1024):
+        self.k = k
+        self.names = []  # Person per label id
+        self._label_ids = {}
+        self._matrix = np.empty((k, capacity), dtype=np.float32)
+        self._labels = np.empty(capacity, dtype=np.int32)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def vectors(self):
+        """N x k view of the enrolled vectors."""
+        return self._matrix[:, :self.size].T
+
+    @property
+    def labels(self):
+        return self._labels[:self.size]
+
+    def _reserve(self, extra):
+        if self.size + extra <= len(self._labels):
+            return
+        capacity = max(2 * len(self._labels), self.size + extra)
+        matrix = np.empty((self.k, capacity), dtype=np.float32)
+        matrix[:, :self.size] = self._matrix[:, :self.size]
+        labels = np.empty(capacity, dtype=np.int32)
+        labels[:self.size] = self._labels[:self.size]
+        self._matrix, self._labels = matrix, labels
+
+    def enroll(self, name, coeffs):
+        """Add B x K coefficient vectors (K >= k, e.g. EigenfaceCodec.encode output) of one person."""
+        coeffs = np.asarray(coeffs).reshape(-1, np.shape(coeffs)[-1])
+        if coeffs.shape[1] < self.k:
+            raise ValueError(f"Gallery compares {self.k} coefficients, got {coeffs.shape[1]}")
+        if name not in self._label_ids:
+            self._label_ids[name] = len(self.names)
+            self.names.append(name)
+        self._reserve(len(coeffs))
+        self._matrix[:, self.size:self.size + len(coeffs)] = normalize(coeffs[:, :self.k]).T
+        self._labels[self.size:self.size + len(coeffs)] = self._label_ids[name]
+        self.size += len(coeffs)
+
+    def search(self, coeffs, top_k=TOP_K):
+        """Closest enrolled vectors to each of B queries; returns (B x top_k scores, B x top_k indices).
+
+        Scores are cosine similarities in decreasing order; indices point into
+        vectors/labels.
+        """
+        queries = normalize(np.asarray(coeffs).reshape(-1, np.shape(coeffs)[-1])[:, :self.k])
+        if self.size == 0:
+            return np.zeros((len(queries), 0), dtype=np.float32), np.zeros((len(queries), 0), dtype=np.int64)
+        scores = queries @ self._matrix[:, :self.size]  # B x N
+        top_k = min(top_k, self.size)
+        indices = np.argpartition(scores, -top_k, axis=1)[:, -top_k:]
+        top_scores = np.take_along_axis(scores, indices, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        return np.take_along_axis(top_scores, order, axis=1), np.take_along_axis(indices, order, axis=1)
+
+    def identify(self, coeffs, top_k=TOP_K, threshold=MATCH_THRESHOLD):
+        """Per query, [(name, score), ...] of the top_k matches that reach threshold (best first)."""
+        scores, indices = self.search(coeffs, top_k)
+        return [[(self.names[self._labels[i]], float(score)) for score, i in zip(row_scores, row_indices)
+                 if score >= threshold]
+                for row_scores, row_indices in zip(scores, indices)]
+
+    def save(self, path):
+        np.savez(path, vectors=self.vectors, labels=self.labels, names=np.array(self.names, dtype=str))
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        gallery = cls(data["vectors"].shape[1], capacity=max(len(data["vectors"]), 1))
+        gallery.names = [str(name) for name in data["names"]]
+        gallery._label_ids = {name: i for i, name in enumerate(gallery.names)}
+        gallery.size = len(data["vectors"])
+        gallery._matrix[:, :gallery.size] = data["vectors"].T
+        gallery._labels[:gallery.size] = data["labels"]
+        return gallery
+
+
+def enroll_directory(gallery, codec, base_dir, batch_size=ENROLL_BATCH):
+    """Enroll every image of base_dir/<person>/ (e.g. script1.py's face_dataset) under the folder name."""
+    for name, paths in list_images_by_class(base_dir).items():
+        faces = [face for face in (decode_image(path, (codec.shape[1], codec.shape[0])) for path in paths)
+                 if face is not None]
+        for start in range(0, len(faces), batch_size):
+            gallery.enroll(name, codec.encode(np.stack(faces[start:start + batch_size])))
+    return gallery
+
+
+if __name__ == "__main__":
+    from basis import open_basis
+    from codec import EigenfaceCodec
+
+    parser = argparse.ArgumentParser(description="Enroll faces into a gallery, or benchmark gallery search")
+    commands = parser.add_subparsers(dest='command', required=True)
+    enroll = commands.add_parser('enroll', help="Enroll base_dir/<person>/ images")
+    enroll.add_argument('basis', help="Eigenbasis (.efb)")
+    enroll.add_argument('data_path', help="Directory with one sub-directory of images per person")
+    enroll.add_argument('gallery', help="Output .npz")
+    enroll.add_argument('--k', type=int, default=GALLERY_K)
+    bench = commands.add_parser('bench', help="Search latency on a random gallery")
+    bench.add_argument('basis', help="Eigenbasis (.efb), for the coefficient spread")
+    bench.add_argument('--size', type=int, default=50000)
+    bench.add_argument('--k', type=int, default=GALLERY_K)
+    bench.add_argument('--queries', type=int, default=1000)
+
+    args = parser.parse_args()
+
+    basis = open_basis(args.basis, args.k)
+    if args.command == 'enroll':
+        gallery = enroll_directory(Gallery(args.k), EigenfaceCodec(basis), args.data_path)
+        gallery.save(args.gallery)
+        print(f"Enrolled {len(gallery)} faces of {len(gallery.names)} people into {args.gallery}")
+    else:
+        rng = np.random.default_rng(0)
+        spread = np.sqrt(basis.eigen_values) if basis.eigen_values is not None else np.ones(args.k)
+        gallery = Gallery(args.k, capacity=args.size)
+        for person in range(0, args.size, 50):
+            gallery.enroll(f"person{person // 50}", rng.standard_normal((min(50, args.size - person), args.k)) * spread)
+        queries = (rng.standard_normal((args.queries, args.k)) * spread).astype(np.float32)
+        times = []
+        for query in queries:
+            start = time.perf_counter()
+            gallery.identify(query[None])
+            times.append(time.perf_counter() - start)
+        times = np.array(times) * 1000
+        print(f"{len(gallery)} vectors x {args.k}: p50 {np.percentile(times, 50):.3f} ms, "
+              f"p99 {np.percentile(times, 99):.3f} ms per query")
@@ -0,0 +1,351 @@
+"""Approximate nearest-neighbour index over eigenface coefficients: inverted file + product quantization.
+
+For galleries too large to scan (gallery.py's exact search reads every
+vector per query), vectors are L2-normalized as in gallery.py and then:
+
+  * assigned to the nearest of nlist coarse k-means centroids (the inverted
+    file), so a query only scans the nprobe lists closest to it;
+  * stored as m one-byte codes of their residual to that centroid, one per
+    k / m dimensional subspace, each indexing a 256-entry codebook (PQ).
+
+A probed list is scored with asymmetric distance computation: per list
+one m x 256 table of query-to-codeword distances, then each stored vector
+costs m table lookups instead of a k-dimensional dot product. On unit
+vectors the squared distance d maps back to cosine similarity as 1 - d / 2,
+so the thresholds of gallery.py apply unchanged.
+
+An index is a directory. codes.npy, labels.npy and ids.npy hold the
+vectors sorted by list and are memory-mapped on load, so list j is the
+zero-copy slice offsets[j]:offsets[j + 1]. add() encodes new vectors
+against the trained centroids and codebooks without retraining; they are
+searched from memory and merged into the sorted files by the next save().
+search() reports vectors by insertion order (id), which saving keeps.
+
+    python ivf.py build gallery.npz faces.ivf
+    python ivf.py bench eigen_faces.efb --size 1000000 --k 100
+"""
+import argparse
+import os
+import time
+
+import cv2
+import numpy as np
+
+from gallery import MATCH_THRESHOLD, normalize, TOP_K
+
+###################################### VARIABLES ######################################
+
+NLIST = 1024  # Coarse partitions; about sqrt(N) for a million faces
+SUBQUANTIZERS = 20  # Codes per vector (bytes); must divide the coefficient count
+CODEBOOK_SIZE = 256  # Codewords per subspace, so each code is one byte
+NPROBE = 16  # Lists scanned per query: higher is slower and more accurate
+TRAIN_SAMPLES = 100000  # Vectors k-means is trained on
+KMEANS_ITERATIONS = 20
+ASSIGN_BATCH = 65536  # Vectors assigned to centroids at a time
+
+META_FILE = "meta.npz"
+CODES_FILE = "codes.npy"
+LABELS_FILE = "labels.npy"
+IDS_FILE = "ids.npy"
+OFFSETS_FILE = "offsets.npy"
+
+########################################################################################
+
+
+def kmeans(X, n_clusters, iterations=KMEANS_ITERATIONS, seed=0):
+    """n_clusters x d float32 centroids of X (cv2.kmeans, k-means++ initialisation)."""
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    if len(X) < n_clusters:
+        raise ValueError(f"Need at least {n_clusters} training vectors, got {len(X)}")
+    cv2.setRNGSeed(seed)
+    criteria = (cv2.TERM_CRITERIA_MAX_ITER + cv2.TERM_CRITERIA_EPS, iterations, 1e-4)
+    _, _, centroids = cv2.kmeans(X, n_clusters, None, criteria, 1, cv2.KMEANS_PP_CENTERS)
+    return centroids
+
+
+def nearest(X, centroids, batch_size=ASSIGN_BATCH):
+    """Index of the closest centroid for every row of X, via ||c||^2 - 2 x.c in BLAS-sized batches."""
+    norms = np.einsum('ij,ij->i', centroids, centroids)
+    assignment = np.empty(len(X), dtype=np.int32)
+    for start in range(0, len(X), batch_size):
+        scores = np.asarray(X[start:start + batch_size], dtype=np.float32) @ centroids.T
+        assignment[start:start + batch_size] = np.argmin(norms - 2 * scores, axis=1)
+    return assignment
+
+
+class IVFPQIndex:
+    """Inverted-file index with product-quantized residuals; see the module docstring."""
+
+    def __init__(self, centroids, codebooks, names=(), codes=None, labels=None, ids=None, offsets=None):
+        self.centroids = np.asarray(centroids, dtype=np.float32)  # nlist x k
+        self.codebooks = np.asarray(codebooks, dtype=np.float32)  # m x 256 x k / m
+        self.codebook_norms = np.einsum('mjd,mjd->mj', self.codebooks, self.codebooks)
+        self.names = list(names)
+        self._label_ids = {name: i for i, name in enumerate(self.names)}
+        m = len(self.codebooks)
+        # Sorted part (usually memory-mapped), list j is rows offsets[j]:offsets[j + 1]
+        self.codes = np.zeros((0, m), dtype=np.uint8) if codes is None else codes
+        self.labels = np.zeros(0, dtype=np.int32) if labels is None else labels
+        self.ids = np.zeros(0, dtype=np.int64) if ids is None else ids
+        self.offsets = np.zeros(self.nlist + 1, dtype=np.int64) if offsets is None else np.asarray(offsets)
+        # Added since the last save, searched from memory
+        self._pending = []  # (lists, codes, labels, ids) chunks
+        self._merged_pending = None
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @property
+    def k(self):
+        return self.centroids.shape[1]
+
+    @property
+    def m(self):
+        return len(self.codebooks)
+
+    def __len__(self):
+        return len(self.codes) + sum(len(chunk[0]) for chunk in self._pending)
+
+    @classmethod
+    def train(cls, vectors, nlist=NLIST, m=SUBQUANTIZERS, train_samples=TRAIN_SAMPLES, seed=0):
+        """Fit the coarse centroids and residual codebooks on (a sample of) N x k coefficient vectors."""
+        vectors = normalize(vectors)
+        if vectors.shape[1] % m:
+            raise ValueError(f"{m} subquantizers do not divide {vectors.shape[1]} coefficients")
+        rng = np.random.default_rng(seed)
+        if len(vectors) > train_samples:
+            vectors = vectors[rng.choice(len(vectors), train_samples, replace=False)]
+        centroids = kmeans(vectors, nlist, seed=seed)
+        residuals = vectors - centroids[nearest(vectors, centroids)]
+        subspaces = residuals.reshape(len(residuals), m, -1)
+        codebooks = np.stack([kmeans(subspaces[:, i], CODEBOOK_SIZE, seed=seed + 1 + i) for i in range(m)])
+        return cls(centroids, codebooks)
+
+    def _encode(self, vectors, lists):
+        """m-byte PQ codes of the residuals of unit vectors to their list centroids."""
+        residuals = (vectors - self.centroids[lists]).reshape(len(vectors), self.m, -1)
+        codes = np.empty((len(vectors), self.m), dtype=np.uint8)
+        for i in range(self.m):
+            codes[:, i] = nearest(residuals[:, i], self.codebooks[i])
+        return codes
+
+    def add(self, name, coeffs):
+        """Add B x K coefficient vectors (K >= k) of one person, like Gallery.enroll."""
+        coeffs = np.asarray(coeffs).reshape(-1, np.shape(coeffs)[-1])
+        if coeffs.shape[1] < self.k:
+            raise ValueError(f"Index compares {self.k} coefficients, got {coeffs.shape[1]}")
+        if name not in self._label_ids:
+            self._label_ids[name] = len(self.names)
+            self.names.append(name)
+        vectors = normalize(coeffs[:, :self.k])
+        lists = nearest(vectors, self.centroids)
+        labels = np.full(len(vectors), self._label_ids[name], dtype=np.int32)
+        ids = np.arange(len(self), len(self) + len(vectors), dtype=np.int64)
+        self._pending.append((lists, self._encode(vectors, lists), labels, ids))
+        self._merged_pending = None
+
+    def _pending_arrays(self):
+        """(lists, codes, labels, ids) of everything added since the last save."""
+        if self._merged_pending is None:
+            chunks = self._pending or [(np.zeros(0, np.int32), np.zeros((0, self.m), np.uint8),
+                                        np.zeros(0, np.int32), np.zeros(0, np.int64))]
+            self._merged_pending = tuple(np.concatenate(arrays) for arrays in zip(*chunks))
+        return self._merged_pending
+
+    def _row_values(self, sorted_values, pending_values, rows):
+        """Per-row values where rows index the sorted part followed by the pending vectors."""
+        in_sorted = rows < len(self.codes)
+        values = np.empty(len(rows), dtype=pending_values.dtype)
+        values[in_sorted] = sorted_values[rows[in_sorted]]
+        values[~in_sorted] = pending_values[rows[~in_sorted] - len(self.codes)]
+        return values
+
+    def _search_one(self, query, top_k, nprobe):
+        # Closest lists to the query
+        coarse = np.einsum('ij,ij->i', self.centroids, self.centroids) - 2 * (self.centroids @ query)
+        probes = np.argpartition(coarse, nprobe - 1)[:nprobe] if nprobe < self.nlist else np.arange(self.nlist)
+
+        # Per probed list, the table of distances from the query residual to every codeword
+        residuals = (query - self.centroids[probes]).reshape(len(probes), self.m, -1)
+        products = np.matmul(residuals.transpose(1, 0, 2), self.codebooks.transpose(0, 2, 1))  # m x nprobe x 256
+        tables = (np.einsum('pmd,pmd->pm', residuals, residuals)[:, :, None]
+                  - 2 * products.transpose(1, 0, 2) + self.codebook_norms)
+
+        # Candidates: the sorted slices of the probed lists, plus pending vectors in them
+        slices = [(j, self.offsets[list_id], self.offsets[list_id + 1]) for j, list_id in enumerate(probes)]
+        rows = np.concatenate([np.arange(start, stop) for _, start, stop in slices]) if slices else np.zeros(0, np.int64)
+        codes = np.concatenate([self.codes[start:stop] for _, start, stop in slices])
+        table_of = np.concatenate([np.full(stop - start, j) for j, start, stop in slices])
+        pending_lists, pending_codes, _, _ = self._pending_arrays()
+        if len(pending_lists):
+            position = np.full(self.nlist, -1)
+            position[probes] = np.arange(len(probes))
+            hits = np.flatnonzero(position[pending_lists] >= 0)
+            rows = np.concatenate([rows, len(self.codes) + hits])
+            codes = np.concatenate([codes, pending_codes[hits]])
+            table_of = np.concatenate([table_of, position[pending_lists[hits]]])
+
+        if not len(codes):
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+
+        # One flat gather: entry (list j, subspace i, code c) of the tables for every candidate
+        flat = table_of[:, None] * (self.m * CODEBOOK_SIZE) + np.arange(0, self.m * CODEBOOK_SIZE, CODEBOOK_SIZE) + codes
+        distances = tables.reshape(-1)[flat].sum(axis=1)
+        top_k = min(top_k, len(distances))
+        best = np.argpartition(distances, top_k - 1)[:top_k] if top_k < len(distances) else np.arange(len(distances))
+        best = best[np.argsort(distances[best])]
+        return 1 - distances[best] / 2, rows[best]
+
+    def _search(self, coeffs, top_k, nprobe):
+        """Per query, (scores, rows) of its best matches."""
+        queries = normalize(np.asarray(coeffs).reshape(-1, np.shape(coeffs)[-1])[:, :self.k])
+        return [self._search_one(query, top_k, min(nprobe, self.nlist)) for query in queries]
+
+    def search(self, coeffs, top_k=TOP_K, nprobe=NPROBE):
+        """Approximate Gallery.search: per query, estimated cosine similarities (best first) and ids.
+
+        ids count vectors in the order they were added. Rows with fewer than
+        top_k candidates (only possible with tiny probed lists) are padded
+        with score -inf and id -1.
+        """
+        results = self._search(coeffs, top_k, nprobe)
+        scores = np.full((len(results), top_k), -np.inf, dtype=np.float32)
+        ids = np.full((len(results), top_k), -1, dtype=np.int64)
+        pending_ids = self._pending_arrays()[3]
+        for i, (row_scores, rows) in enumerate(results):
+            scores[i, :len(rows)] = row_scores
+            ids[i, :len(rows)] = self._row_values(self.ids, pending_ids, rows)
+        return scores, ids
+
+    def identify(self, coeffs, top_k=TOP_K, threshold=MATCH_THRESHOLD, nprobe=NPROBE):
+        """Like Gallery.identify: per query, [(name, score), ...] reaching threshold."""
+        pending_labels = self._pending_arrays()[2]
+        results = []
+        for row_scores, rows in self._search(coeffs, top_k, nprobe):
+            labels = self._row_values(self.labels, pending_labels, rows)
+            results.append([(self.names[label], float(score)) for score, label in zip(row_scores, labels)
+                            if score >= threshold])
+        return results
+
+    def save(self, path):
+        """Write the index directory, merging pending vectors into the sorted, memory-mappable files."""
+        os.makedirs(path, exist_ok=True)
+        pending_lists, pending_codes, pending_labels, pending_ids = self._pending_arrays()
+        sorted_lists = np.repeat(np.arange(self.nlist, dtype=np.int32), np.diff(self.offsets))
+        lists = np.concatenate([sorted_lists, pending_lists])
+        order = np.argsort(lists, kind="stable")
+        offsets = np.zeros(self.nlist + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(lists, minlength=self.nlist))
+
+        # Write next to the old files and swap them in, so a mapped index stays readable meanwhile
+        for name, data in ((CODES_FILE, np.concatenate([self.codes, pending_codes])[order]),
+                           (LABELS_FILE, np.concatenate([self.labels, pending_labels])[order]),
+                           (IDS_FILE, np.concatenate([self.ids, pending_ids])[order]),
+                           (OFFSETS_FILE, offsets)):
+            with open(os.path.join(path, name + ".tmp"), "wb") as f:
+                np.save(f, data)
+            os.replace(os.path.join(path, name + ".tmp"), os.path.join(path, name))
+        np.savez(os.path.join(path, META_FILE), centroids=self.centroids, codebooks=self.codebooks,
+                 names=np.array(self.names, dtype=str))
+
+        self.codes = np.load(os.path.join(path, CODES_FILE), mmap_mode='r')
+        self.labels = np.load(os.path.join(path, LABELS_FILE), mmap_mode='r')
+        self.ids = np.load(os.path.join(path, IDS_FILE), mmap_mode='r')
+        self.offsets = offsets
+        self._pending, self._merged_pending = [], None
+
+    @classmethod
+    def load(cls, path):
+        """Open an index directory; codes and labels stay memory-mapped."""
+        meta = np.load(os.path.join(path, META_FILE))
+        return cls(meta["centroids"], meta["codebooks"], [str(name) for name in meta["names"]],
+                   np.load(os.path.join(path, CODES_FILE), mmap_mode='r'),
+                   np.load(os.path.join(path, LABELS_FILE), mmap_mode='r'),
+                   np.load(os.path.join(path, IDS_FILE), mmap_mode='r'),
+                   np.load(os.path.join(path, OFFSETS_FILE)))
+
+
+def synthetic_gallery(size, k, spread, people=None, seed=0):
+    """(names, N x k vectors): people clusters of faces drawn with per-coefficient spread."""
+    rng = np.random.default_rng(seed)
+    people = people or max(size // 20, 1)
+    centers = rng.standard_normal((people, k)) * spread
+    labels = rng.integers(people, size=size)
+    vectors = centers[labels] + 0.3 * rng.standard_normal((size, k)) * spread
+    return labels, vectors.astype(np.float32)
+
+
+if __name__ == "__main__":
+    from gallery import Gallery
+
+    parser = argparse.ArgumentParser(description="Build an IVF-PQ index, or benchmark recall vs latency against exact search")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="Index the vectors of a gallery.py .npz")
+    build.add_argument('gallery')
+    build.add_argument('index', help="Output index directory")
+    build.add_argument('--nlist', type=int, default=NLIST)
+    build.add_argument('--m', type=int, default=SUBQUANTIZERS)
+    bench = commands.add_parser('bench', help="Recall and latency per nprobe on a synthetic gallery")
+    bench.add_argument('basis', help="Eigenbasis (.efb), for the coefficient spread")
+    bench.add_argument('--size', type=int, default=1000000)
+    bench.add_argument('--k', type=int, default=100)
+    bench.add_argument('--nlist', type=int, default=NLIST)
+    bench.add_argument('--m', type=int, default=SUBQUANTIZERS)
+    bench.add_argument('--queries', type=int, default=200)
+    bench.add_argument('--top_k', type=int, default=10)
+    bench.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64])
+    bench.add_argument('--index', help="Also save the index here and reload it memory-mapped")
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        gallery = Gallery.load(args.gallery)
+        start = time.perf_counter()
+        index = IVFPQIndex.train(gallery.vectors, min(args.nlist, len(gallery)), args.m)
+        for label, name in enumerate(gallery.names):
+            index.add(name, gallery.vectors[gallery.labels == label])
+        index.save(args.index)
+        print(f"Indexed {len(index)} vectors into {args.index} in {time.perf_counter() - start:.1f}s")
+    else:
+        from basis import open_basis
+
+        basis = open_basis(args.basis, args.k)
+        spread = np.sqrt(basis.eigen_values) if basis.eigen_values is not None else np.ones(args.k)
+        labels, vectors = synthetic_gallery(args.size + args.queries, args.k, spread)
+        queries, vectors, labels = vectors[:args.queries], vectors[args.queries:], labels[args.queries:]
+
+        start = time.perf_counter()
+        index = IVFPQIndex.train(vectors, args.nlist, args.m)
+        print(f"Trained on {min(len(vectors), TRAIN_SAMPLES)} vectors in {time.perf_counter() - start:.1f}s")
+        start = time.perf_counter()
+        for person in np.unique(labels):
+            index.add(f"person{person}", vectors[labels == person])
+        print(f"Added {len(index)} vectors in {time.perf_counter() - start:.1f}s")
+        if args.index:
+            index.save(args.index)
+            index = IVFPQIndex.load(args.index)
+
+        # Exact reference: the brute-force gallery, enrolled in the same order so its rows are the index's ids
+        gallery = Gallery(args.k, capacity=len(vectors))
+        for person in np.unique(labels):
+            gallery.enroll(f"person{person}", vectors[labels == person])
+        exact, times = [], []
+        for query in queries:
+            start = time.perf_counter()
+            exact.append(gallery.search(query[None], args.top_k)[1][0])
+            times.append(time.perf_counter() - start)
+        print(f"exact: p50 {np.percentile(times, 50) * 1e3:.3f} ms")
+
+        for nprobe in args.nprobe:
+            hits, top1, times = 0, 0, []
+            for query, truth in zip(queries, exact):
+                start = time.perf_counter()
+                _, ids = index.search(query[None], args.top_k, nprobe)
+                times.append(time.perf_counter() - start)
+                found = ids[0]
+                hits += len(np.intersect1d(found, truth))
+                top1 += truth[0] in found
+            print(f"nprobe {nprobe:4d}: recall@{args.top_k} {hits / (len(queries) * args.top_k):.3f}, "
+                  f"1-recall@{args.top_k} {top1 / len(queries):.3f}, "
+                  f"p50 {np.percentile(times, 50) * 1e3:.3f} ms, p99 {np.percentile(times, 99) * 1e3:.3f} ms")
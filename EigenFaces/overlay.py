@@ -0,0 +1,89 @@
+"""Window compositor: static chrome is drawn once, each frame only touches what changed.
+
+Draw backgrounds, frames and fixed labels onto Overlay.template once, register
+the dynamic face tiles and text fields, and call build(). After that, set_tile
+resizes a face straight into its spot on the persistent canvas and set_text
+only repaints a field when its string actually changed, so per-frame render
+cost no longer grows with the amount of chrome. A repaint restores the
+template under the old and new text and under every field that overlaps
+them, then redraws those fields in registration order, so the canvas stays
+identical to a full redraw.
+"""
+import cv2
+import numpy as np
+
+###################################### VARIABLES ######################################
+
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+########################################################################################
+
+
+class Overlay:
+    def __init__(self, height, width, background=(0, 0, 0)):
+        self.template = np.empty((height, width, 3), dtype=np.uint8)
+        self.template[:] = background
+        self.canvas = None
+        self.tiles = {}  # name -> (x, y, size, gray scratch)
+        self.texts = {}  # name -> dict(origin, scale, color, thickness, value, box)
+
+    def add_tile(self, name, x, y, size):
+        """Square size x size grayscale slot with its top-left corner at (x, y)."""
+        self.tiles[name] = (x, y, size, np.empty((size, size), dtype=np.uint8))
+
+    def add_text(self, name, origin, scale, color, thickness):
+        """Text field drawn with cv2.putText at origin (bottom-left of the text)."""
+        self.texts[name] = dict(origin=origin, scale=scale, color=color, thickness=thickness, value="", box=None)
+
+    def build(self):
+        """Freeze the template; the canvas starts as a copy of it."""
+        self.canvas = self.template.copy()
+        return self
+
+    def set_tile(self, name, gray):
+        x, y, size, scratch = self.tiles[name]
+        cv2.resize(gray, (size, size), dst=scratch)
+        cv2.cvtColor(scratch, cv2.COLOR_GRAY2BGR, dst=self.canvas[y:y + size, x:x + size])
+
+    def _text_box(self, field, value):
+        (w, h), baseline = cv2.getTextSize(value, FONT, field["scale"], field["thickness"])
+        x, y = field["origin"]
+        pad = field["thickness"]
+        height, width = self.canvas.shape[:2]
+        return (max(x - pad, 0), max(y - h - pad, 0), min(x + w + pad, width), min(y + baseline + pad, height))
+
+    def set_text(self, name, value):
+        """Show value in the field; a no-op when it is unchanged."""
+        field = self.texts[name]
+        if value == field["value"]:
+            return
+        dirty = [field["box"]] if field["box"] is not None else []  # Old string
+        field["value"] = value
+        field["box"] = self._text_box(field, value) if value else None
+        if field["box"] is not None:
+            dirty.append(field["box"])
+        # Every field touching a dirty area is repainted, so its whole box becomes dirty too
+        redraw = {name}
+        grown = True
+        while grown:
+            grown = False
+            for other_name, other in self.texts.items():
+                if other_name not in redraw and other["box"] is not None and \
+                        any(_overlaps(box, other["box"]) for box in dirty):
+                    redraw.add(other_name)
+                    dirty.append(other["box"])
+                    grown = True
+        for x1, y1, x2, y2 in dirty:
+            self.canvas[y1:y2, x1:x2] = self.template[y1:y2, x1:x2]
+        for other_name, other in self.texts.items():
+            if other_name in redraw:
+                self._draw(other)
+
+    def _draw(self, field):
+        if field["value"]:
+            cv2.putText(self.canvas, field["value"], field["origin"], FONT, field["scale"], field["color"],
+                        field["thickness"])
+
+
+def _overlaps(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
@@ -0,0 +1,247 @@
+"""Threaded capture -> detect -> encode -> render pipeline with bounded, drop-oldest queues.
+
+Each stage runs in its own thread and hands dict items to the next through a
+DropOldestQueue, so a slow stage only ever sees the freshest work and latency
+cannot pile up behind it. Rendering stays on the main thread (HighGUI
+windows must be driven from there); it pulls finished items with get().
+An exception in any thread stops the whole pipeline and is raised again
+from get(), so the render loop ends instead of waiting for items forever.
+"""
+import threading
+import time
+from collections import deque
+
+###################################### VARIABLES ######################################
+
+QUEUE_SIZE = 2  # Items buffered between stages; older ones are dropped
+GET_TIMEOUT = 0.1  # Seconds a stage waits for input before checking for shutdown
+STATS_SMOOTHING = 0.1  # EWMA weight of a new latency sample
+STATS_INTERVAL = 5.0  # Seconds between printed pipeline stats
+POOL_SIZE = 2 * QUEUE_SIZE + 3  # Buffers in flight: one per stage plus full queues
+
+########################################################################################
+
+
+class DropOldestQueue:
+    """Bounded queue whose put never blocks: when full, the oldest item is discarded (and passed to on_drop)."""
+
+    def __init__(self, maxsize=QUEUE_SIZE, on_drop=None):
+        self.items = deque(maxlen=maxsize)
+        self.dropped = 0
+        self.on_drop = on_drop
+        self.condition = threading.Condition()
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, item):
+        with self.condition:
+            if len(self.items) == self.items.maxlen:
+                self.dropped += 1
+                if self.on_drop is not None:
+                    self.on_drop(self.items.popleft())
+            self.items.append(item)
+            self.condition.notify()
+
+    def get(self, timeout=None):
+        """Oldest item, or None if nothing arrived within timeout."""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.items, timeout):
+                return None
+            return self.items.popleft()
+
+
+class BufferPool:
+    """Recycles per-item work buffers (e.g. codec.CodecBuffers) between stages.
+
+    A stage takes buffers with acquire() and stores them in the item under
+    "buffers"; the pipeline gives them back once the item is rendered or
+    dropped. New buffers are only allocated while every pooled one is in
+    flight, so steady state allocates nothing.
+    """
+
+    def __init__(self, factory, size=POOL_SIZE):
+        self.factory = factory
+        self.free = [factory() for _ in range(size)]
+        self.allocated = size
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            if self.free:
+                return self.free.pop()
+            self.allocated += 1
+        return self.factory()
+
+    def release(self, buffers):
+        with self.lock:
+            self.free.append(buffers)
+
+
+class StageStats:
+    """Smoothed per-item processing time and age (time since capture) of one stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+        self.age = 0.0
+
+    def record(self, seconds, captured=None):
+        weight = 1.0 if self.count == 0 else STATS_SMOOTHING
+        self.count += 1
+        self.latency += weight * (seconds - self.latency)
+        self.max_latency = max(self.max_latency, seconds)
+        if captured is not None:
+            self.age += weight * (time.monotonic() - captured - self.age)
+
+    def __str__(self):
+        return f"{self.name} {self.latency * 1000:.1f}ms (max {self.max_latency * 1000:.1f}, age {self.age * 1000:.1f})"
+
+
+class FrameGrabber(threading.Thread):
+    """Reads the camera as fast as it delivers frames; downstream only ever sees the latest one."""
+
+    def __init__(self, cap, outbox, on_capture=None, on_error=None):
+        super().__init__(name="capture", daemon=True)
+        self.cap = cap
+        self.outbox = outbox
+        self.on_capture = on_capture
+        self.on_error = on_error
+        self.stats = StageStats("capture")
+        self.stopped = threading.Event()
+        self.finished = threading.Event()  # Camera ran out of frames (or failed)
+
+    def run(self):
+        try:
+            while not self.stopped.is_set():
+                start = time.monotonic()
+                ret, frame = self.cap.read()
+                if not ret:
+                    break
+                self.stats.record(time.monotonic() - start)
+                if self.on_capture is not None:
+                    self.on_capture()
+                self.outbox.put({"frame": frame, "captured": time.monotonic()})
+        except Exception as error:
+            if self.on_error is None:
+                raise
+            self.on_error(self, error)
+        finally:
+            self.finished.set()
+
+
+class Stage(threading.Thread):
+    """Applies func to every item from inbox and forwards the result (None drops the item)."""
+
+    def __init__(self, name, func, inbox, outbox, on_drop=None, on_error=None):
+        super().__init__(name=name, daemon=True)
+        self.func = func
+        self.inbox = inbox
+        self.outbox = outbox
+        self.on_drop = on_drop
+        self.on_error = on_error
+        self.stats = StageStats(name)
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.is_set():
+                item = self.inbox.get(GET_TIMEOUT)
+                if item is None:
+                    continue
+                start = time.monotonic()
+                result = self.func(item)
+                self.stats.record(time.monotonic() - start, item["captured"])
+                if result is not None:
+                    self.outbox.put(result)
+                elif self.on_drop is not None:
+                    self.on_drop(item)
+        except Exception as error:
+            if self.on_error is None:
+                raise
+            self.on_error(self, error)
+
+
+class Pipeline:
+    """Camera grabber followed by (name, func) stages; the caller renders what comes out.
+
+    The grabber's queue holds a single frame, the others QUEUE_SIZE items.
+    Call rendered() after displaying an item so the render stage shows up
+    in the stats next to the threaded ones, and so the item's buffers go
+    back to pool.
+    """
+
+    def __init__(self, cap, stages, queue_size=QUEUE_SIZE, pool=None):
+        self.pool = pool
+        self.error = None  # (thread name, exception) of the first failure
+        self._in_flight = 0  # Frames captured but not yet rendered or dropped
+        self._lock = threading.Lock()
+        self.queues = [DropOldestQueue(1, self.release)] + [DropOldestQueue(queue_size, self.release) for _ in stages]
+        self.grabber = FrameGrabber(cap, self.queues[0], self._captured, self.fail)
+        self.stages = [Stage(name, func, inbox, outbox, self.release, self.fail)
+                       for (name, func), inbox, outbox in zip(stages, self.queues, self.queues[1:])]
+        self.render_stats = StageStats("render")
+        self._last_stats = time.monotonic()
+
+    @property
+    def finished(self):
+        """The camera ran out and every frame it delivered has been rendered or dropped."""
+        return self.grabber.finished.is_set() and self._in_flight == 0
+
+    def _captured(self):
+        with self._lock:
+            self._in_flight += 1
+
+    def fail(self, thread, error):
+        """Record a thread's exception and stop every thread; get() raises it."""
+        with self._lock:
+            if self.error is None:
+                self.error = (thread.name, error)
+        for thread in [self.grabber] + self.stages:
+            thread.stopped.set()
+
+    def start(self):
+        for thread in [self.grabber] + self.stages:
+            thread.start()
+        return self
+
+    def stop(self):
+        for thread in [self.grabber] + self.stages:
+            thread.stopped.set()
+        for thread in [self.grabber] + self.stages:
+            thread.join()
+
+    def get(self, timeout=GET_TIMEOUT):
+        """Next finished item for the render loop, or None; raises if a thread failed."""
+        if self.error is not None:
+            name, error = self.error
+            raise RuntimeError(f"Pipeline {name} thread failed: {error!r}") from error
+        return self.queues[-1].get(timeout)
+
+    def release(self, item):
+        """Return the item's buffers to the pool (rendered or dropped)."""
+        if self.pool is not None and "buffers" in item:
+            self.pool.release(item.pop("buffers"))
+        with self._lock:
+            self._in_flight -= 1
+
+    def rendered(self, item, start):
+        """Record a render that began at start (time.monotonic()) and recycle the item's buffers."""
+        self.render_stats.record(time.monotonic() - start, item["captured"])
+        self.release(item)
+
+    def summary(self):
+        """One line per stage: latency, age and the depth/drops of the queue feeding it."""
+        stats = [self.grabber.stats] + [stage.stats for stage in self.stages] + [self.render_stats]
+        lines = [str(self.grabber.stats)]
+        for stat, queue in zip(stats[1:], self.queues):
+            lines.append(f"{stat} | queue {len(queue)}/{queue.items.maxlen}, dropped {queue.dropped}")
+        return "\n".join(lines)
+
+    def log_stats(self):
+        """Print the summary every STATS_INTERVAL seconds."""
+        if time.monotonic() - self._last_stats > STATS_INTERVAL:
+            print(self.summary())
+            self._last_stats = time.monotonic()
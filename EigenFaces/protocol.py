@@ -0,0 +1,281 @@
+"""Binary datagram format for eigenface coefficients (see PROTOCOL.md)."""
+import struct
+import time
+from collections import namedtuple
+
+import numpy as np
+
+###################################### VARIABLES ######################################
+
+MAGIC = 0xEF5A
+VERSION = 2
+
+# magic, version, dtype, seq, timestamp_us, k, offset, count, face_id, flags, layer, layers, payload_len
+HEADER_FORMAT = "!HBBIQHHHBBBBH"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+DTYPE_FLOAT32 = 0
+DTYPE_FLOAT16 = 1
+DTYPE_QUANTIZED = 2  # CoefficientQuantizer payload (quantize.py)
+LEVEL_SHIFT = 4  # Quantized payloads carry their quantizer ladder rung in the dtype's high nibble
+
+FLAG_KEYFRAME = 1  # Self-contained frame, resets the receiver's reference
+FLAG_DELTA = 2  # Payload is the difference to frame seq - 1 (temporal.py)
+FLAG_KEYFRAME_REQUEST = 4  # Control datagram without payload: please send a keyframe
+FLAG_PING = 8  # Control: RTT probe, timestamp_us is the sender's clock
+FLAG_PONG = 16  # Control: answer to a ping, echoes its timestamp_us
+FLAG_REPORT = 32  # Control: receiver report (REPORT_FORMAT payload)
+CONTROL_FLAGS = FLAG_KEYFRAME_REQUEST | FLAG_PING | FLAG_PONG | FLAG_REPORT
+
+# highest seq received, fraction of datagrams lost (1/65535 units), interarrival jitter in us
+REPORT_FORMAT = "!IHI"
+
+# First coefficient of each layer. Layer 0 is the base layer; every layer is
+# its own datagram so losing an enhancement layer only loses detail.
+LAYER_STARTS = (0, 64, 256)
+
+MAX_DATAGRAM = 65507  # Largest UDP payload over IPv4
+RING_SLOTS = 8
+
+########################################################################################
+
+FrameHeader = namedtuple("FrameHeader", "dtype seq timestamp_us k offset count face_id flags layer layers length")
+
+
+def layer_ranges(k, starts=LAYER_STARTS):
+    """[(start, stop), ...] coefficient ranges of the layers of a k-coefficient frame."""
+    starts = [s for s in starts if s < k] or [0]
+    return list(zip(starts, starts[1:] + [k]))
+
+
+def encode_payload(coeffs, quantizer=None, start=0, stop=None, level=0):
+    """(dtype, payload) for coefficients [start, stop): quantized when a quantizer is given, float32 otherwise.
+
+    level is the quantizer's rung in the shared ladder (quantize.BIT_BUDGET_LADDER).
+    """
+    if quantizer is not None:
+        return DTYPE_QUANTIZED | level << LEVEL_SHIFT, quantizer.encode(coeffs, start, stop)
+    return DTYPE_FLOAT32, np.ascontiguousarray(coeffs[start:stop], dtype="<f4").tobytes()
+
+
+def pack_layers(seq, dtype, k, layers, face_id=0, timestamp_us=None, flags=0):
+    """One datagram per (start, stop, payload) layer, all sharing seq and capture time."""
+    if timestamp_us is None:
+        timestamp_us = time.time_ns() // 1000
+    return [struct.pack(HEADER_FORMAT, MAGIC, VERSION, dtype, seq & 0xFFFFFFFF, timestamp_us, k, start,
+                        stop - start, face_id, flags, layer, len(layers), len(payload)) + payload
+            for layer, (start, stop, payload) in enumerate(layers)]
+
+
+def pack_frame(seq, coeffs, face_id=0, timestamp_us=None, quantizer=None, flags=FLAG_KEYFRAME):
+    """Serialize one face's coefficients as self-contained layered datagrams."""
+    k = quantizer.k if quantizer is not None else len(coeffs)
+    layers = []
+    for start, stop in layer_ranges(k):
+        dtype, payload = encode_payload(coeffs, quantizer, start, stop)
+        layers.append((start, stop, payload))
+    return pack_layers(seq, dtype, k, layers, face_id, timestamp_us, flags)
+
+
+def pack_control(flags, payload=b"", timestamp_us=None):
+    """Single control datagram (k = 0, no coefficients)."""
+    return pack_layers(0, DTYPE_FLOAT32, 0, [(0, 0, payload)], timestamp_us=timestamp_us, flags=flags)[0]
+
+
+def pack_keyframe_request():
+    return pack_control(FLAG_KEYFRAME_REQUEST)
+
+
+def pack_ping():
+    """RTT probe stamped with the monotonic clock; only the sender reads it back, from the pong."""
+    return pack_control(FLAG_PING, timestamp_us=time.monotonic_ns() // 1000)
+
+
+def pack_pong(ping):
+    """Answer ping (a FrameHeader) by echoing its timestamp."""
+    return pack_control(FLAG_PONG, timestamp_us=ping.timestamp_us)
+
+
+def pack_report(highest_seq, fraction_lost, jitter_us):
+    payload = struct.pack(REPORT_FORMAT, highest_seq & 0xFFFFFFFF, int(round(min(max(fraction_lost, 0), 1) * 0xFFFF)),
+                          min(int(jitter_us), 0xFFFFFFFF))
+    return pack_control(FLAG_REPORT, payload)
+
+
+def unpack_report(payload):
+    """Report payload -> (highest_seq, fraction_lost, jitter_us); raises ValueError if malformed."""
+    try:
+        highest_seq, lost, jitter_us = struct.unpack(REPORT_FORMAT, payload)
+    except struct.error as e:
+        raise ValueError(f"Bad report: {e}")
+    return highest_seq, lost / 0xFFFF, jitter_us
+
+
+def unpack_header(buffer):
+    """Parse and validate the header of a datagram; raises ValueError on anything malformed."""
+    if len(buffer) < HEADER_SIZE:
+        raise ValueError("Datagram shorter than header")
+    magic, version, *fields = struct.unpack_from(HEADER_FORMAT, buffer)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Bad magic/version {magic:#x}/{version}")
+    header = FrameHeader(*fields)
+    if HEADER_SIZE + header.length > len(buffer):
+        raise ValueError("Truncated payload")
+    if header.offset + header.count > header.k or header.layer >= max(header.layers, 1):
+        raise ValueError("Layer outside the frame")
+    return header
+
+
+def seq_newer(a, b):
+    """True if 32-bit sequence number a comes after b (wrap-around safe)."""
+    return 0 < ((a - b) & 0xFFFFFFFF) < 0x80000000
+
+
+def stream_restarted(header, newest_seq, newest_timestamp_us):
+    """True if header opens a new stream of a restarted sender (seq starts again from 0).
+
+    That is a keyframe base layer whose seq is not after the newest one seen
+    although it was captured later; a late datagram of the running stream
+    always carries an older capture time.
+    """
+    return bool(header.flags & FLAG_KEYFRAME) and header.layer == 0 and newest_seq is not None \
+        and not seq_newer(header.seq, newest_seq) and header.timestamp_us > newest_timestamp_us
+
+
+def _ladder(quantizer):
+    if quantizer is None:
+        return []
+    return list(quantizer) if isinstance(quantizer, (list, tuple)) else [quantizer]
+
+
+class CoefficientRing:
+    """Preallocated ring of decoded coefficient vectors fed straight from the socket.
+
+    receive() reads into one reusable buffer with recvfrom_into, views the
+    payload with np.frombuffer and decodes each layer into its range of the
+    frame's ring slot, so no per-packet objects are created. Missing layers
+    stay zero, which is exact for an orthonormal basis: the frame is shown
+    with whatever layers arrived by the time latest() is called.
+
+    Delta layers are added to the same layer of frame seq - 1 and are only
+    valid if that layer was; otherwise the range stays zero and
+    keyframe_needed is raised until a keyframe arrives. Coefficients at or
+    beyond a frame's k are zero by definition, so layers past k are never
+    sent and count as valid. A restarted sender (see stream_restarted)
+    clears the ring instead of being dropped as too old.
+    """
+
+    def __init__(self, k, quantizer=None, delta_quantizer=None, slots=RING_SLOTS):
+        self.k = k
+        # A single quantizer or a ladder of them, indexed by the level in the dtype
+        self.quantizers = _ladder(quantizer)
+        self.delta_quantizers = _ladder(delta_quantizer)
+        self.keyframe_needed = False
+        self.coeffs = np.zeros((slots, k), dtype=np.float32)
+        self.headers = [None] * slots
+        self.seqs = [None] * slots
+        self.received = [0] * slots  # Bitmask of layers that arrived
+        self.valid = [0] * slots  # Bitmask of layers that decoded against a valid reference
+        self.latest_slot = None
+        self.newest_seq = self.newest_timestamp_us = None  # Newest frame datagram accepted
+        self.dropped = 0
+        self._buffer = bytearray(MAX_DATAGRAM)
+        self._view = memoryview(self._buffer)
+
+    def reset(self):
+        """Forget every frame, e.g. when the sender restarted its stream."""
+        self.coeffs[:] = 0
+        self.headers = [None] * len(self.coeffs)
+        self.seqs = [None] * len(self.coeffs)
+        self.received = [0] * len(self.coeffs)
+        self.valid = [0] * len(self.coeffs)
+        self.latest_slot = None
+        self.newest_seq = self.newest_timestamp_us = None
+        self.keyframe_needed = False
+
+    def _slot_for(self, seq):
+        """Slot holding frame seq, starting a fresh one for a new frame; None if seq is too old."""
+        slot = seq % len(self.coeffs)
+        if self.seqs[slot] == seq:
+            return slot
+        if self.seqs[slot] is not None and not seq_newer(seq, self.seqs[slot]):
+            return None
+        self.coeffs[slot] = 0
+        self.seqs[slot] = seq
+        self.headers[slot] = None
+        self.received[slot] = self.valid[slot] = 0
+        return slot
+
+    def payload(self, header):
+        """Payload of the datagram just received (e.g. a report); only valid until the next receive()."""
+        return self._view[HEADER_SIZE:HEADER_SIZE + header.length]
+
+    def _decode_layer(self, header, payload, out):
+        dtype, level = header.dtype & ((1 << LEVEL_SHIFT) - 1), header.dtype >> LEVEL_SHIFT
+        quantizers = self.delta_quantizers if header.flags & FLAG_DELTA else self.quantizers
+        quantizer = quantizers[level] if level < len(quantizers) else None
+        start, stop = header.offset, header.offset + header.count
+        if dtype == DTYPE_QUANTIZED and quantizer is not None and stop <= quantizer.k:
+            quantizer.decode(payload, out=out, start=start, stop=stop)
+            return True
+        if header.dtype in (DTYPE_FLOAT32, DTYPE_FLOAT16) and stop <= self.k \
+                and header.length == header.count * (4 if header.dtype == DTYPE_FLOAT32 else 2):
+            out[start:stop] = np.frombuffer(payload, dtype="<f4" if header.dtype == DTYPE_FLOAT32 else "<f2")
+            return True
+        return False
+
+    def receive(self, sock):
+        """Read one datagram from sock; returns (header, addr), header is None if it was dropped."""
+        nbytes, addr = sock.recvfrom_into(self._buffer)
+        try:
+            header = unpack_header(self._view[:nbytes])
+        except ValueError:
+            self.dropped += 1
+            return None, addr
+        if header.flags & CONTROL_FLAGS:
+            return header, addr  # Control message, nothing to decode (see payload())
+
+        if stream_restarted(header, self.newest_seq, self.newest_timestamp_us):
+            self.reset()
+        slot = self._slot_for(header.seq)
+        bit = 1 << header.layer
+        if slot is None or self.received[slot] & bit:
+            self.dropped += 1  # Too old or duplicate
+            return None, addr
+
+        out = self.coeffs[slot]
+        payload = self._view[HEADER_SIZE:HEADER_SIZE + header.length]
+        if not self._decode_layer(header, payload, out):
+            self.dropped += 1
+            return None, addr
+        self.received[slot] |= bit
+        if self.newest_seq is None or seq_newer(header.seq, self.newest_seq):
+            self.newest_seq, self.newest_timestamp_us = header.seq, header.timestamp_us
+        self.valid[slot] |= ~((1 << header.layers) - 1) & 0xFF  # Layers past k: zero, nothing to wait for
+        self.headers[slot] = header
+
+        start, stop = header.offset, header.offset + header.count
+        if header.flags & FLAG_DELTA:
+            previous = (header.seq - 1) % len(self.coeffs)
+            if self.seqs[previous] == (header.seq - 1) & 0xFFFFFFFF and self.valid[previous] & bit:
+                out[start:stop] += self.coeffs[previous, start:stop]
+                self.valid[slot] |= bit
+            else:
+                out[start:stop] = 0  # Reference layer lost
+                self.keyframe_needed = True
+        else:
+            self.valid[slot] |= bit
+            if header.layer == 0:
+                self.keyframe_needed = False
+
+        # A frame becomes displayable once its base layer is usable
+        if self.valid[slot] & 1 and (self.latest_slot is None
+                                     or seq_newer(header.seq, self.seqs[self.latest_slot])):
+            self.latest_slot = slot
+        return header, addr
+
+    def latest(self):
+        """(header, coeffs) of the newest frame with a usable base layer, or (None, None)."""
+        if self.latest_slot is None:
+            return None, None
+        return self.headers[self.latest_slot], self.coeffs[self.latest_slot]
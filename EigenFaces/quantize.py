@@ -0,0 +1,166 @@
+import argparse
+
+import numpy as np
+
+from basis import open_basis
+from codec import EigenfaceCodec
+
+###################################### VARIABLES ######################################
+
+BIT_BUDGET = 2048  # Bits per face (256 bytes vs 2800 for 700 float32 coefficients)
+MAX_BITS = 16  # Per-component cap
+
+# Quantization depths the sender may switch between under congestion (feedback.py).
+# Both peers build the same ladder; a payload names its rung in the header's dtype.
+BIT_BUDGET_LADDER = (2048, 1024, 512, 256)
+
+# Step size (in standard deviations) of the MSE-optimal uniform quantizer for a
+# Gaussian source, indexed by bits (Max, 1960). Beyond 8 bits the range is +-4 sigma.
+GAUSSIAN_STEPS = {1: 1.596, 2: 0.996, 3: 0.586, 4: 0.335, 5: 0.188, 6: 0.104, 7: 0.057, 8: 0.031}
+WIDE_RANGE_SIGMAS = 4.0
+
+########################################################################################
+
+
+def allocate_bits(eigen_values, bit_budget=BIT_BUDGET, max_bits=MAX_BITS):
+    """Reverse water-filling: b_i = 0.5 * log2(lambda_i / theta), with theta chosen to fit the budget.
+
+    Leading (high-variance) components get the most bits, the tail gets none.
+    """
+    variances = np.maximum(np.asarray(eigen_values, dtype=np.float64), 1e-12)
+
+    def bits_for(log_theta):
+        return np.clip(np.round(0.5 * (np.log2(variances) - log_theta)), 0, max_bits).astype(np.int64)
+
+    lo, hi = np.log2(variances.min()) - 2 * max_bits, np.log2(variances.max()) + 2
+    for _ in range(60):
+        mid = (lo + hi) / 2
+        if bits_for(mid).sum() > bit_budget:
+            lo = mid
+        else:
+            hi = mid
+    return bits_for(hi)
+
+
+class CoefficientQuantizer:
+    """Per-component uniform quantizer with rate-distortion bit allocation.
+
+    encode packs the quantized coefficients MSB-first into bytes; decode is
+    the matching dequantizer on the receive side. Both ends must build it
+    from the same eigenvalues and bit budget.
+    """
+
+    def __init__(self, eigen_values, bit_budget=BIT_BUDGET, max_bits=MAX_BITS):
+        self.k = len(eigen_values)
+        self.bits = allocate_bits(eigen_values, bit_budget, max_bits)
+        self.active = np.flatnonzero(self.bits)  # Components that get any bits
+
+        sigma = np.sqrt(np.maximum(np.asarray(eigen_values, dtype=np.float64), 0))[self.active]
+        bits = self.bits[self.active]
+        self.levels = (1 << bits).astype(np.int64)
+        unit_step = np.array([GAUSSIAN_STEPS.get(b, 2 * WIDE_RANGE_SIGMAS / (1 << b)) for b in bits])
+        self.step = (unit_step * sigma).astype(np.float32)
+        self.offset = (self.step * self.levels / 2).astype(np.float32)  # Half the covered range
+
+        # Bit-plane mask used to (un)pack variable-width codes in one vectorized pass
+        self.max_bits = int(bits.max()) if len(bits) else 0
+        self.shifts = np.arange(self.max_bits - 1, -1, -1, dtype=np.int64)
+        self.mask = self.shifts[None, :] < bits[:, None]
+        self.total_bits = int(bits.sum())
+
+        # Expected squared error per component (uniform noise, step^2 / 12)
+        self.noise = np.zeros(self.k)
+        self.noise[self.active] = self.step.astype(np.float64) ** 2 / 12
+
+    @property
+    def nbytes(self):
+        return (self.total_bits + 7) // 8
+
+    def payload_size(self, start=0, stop=None):
+        """Bytes encode() produces for coefficients [start, stop)."""
+        lo, hi = self._rows(start, stop)
+        return (int(self.mask[lo:hi].sum()) + 7) // 8
+
+    def _rows(self, start, stop):
+        """Active-component rows covering coefficient indices [start, stop)."""
+        stop = self.k if stop is None else stop
+        return np.searchsorted(self.active, start), np.searchsorted(self.active, stop)
+
+    def quantize(self, coeffs):
+        """Coefficients -> integer codes for the active components."""
+        coeffs = np.asarray(coeffs, dtype=np.float32)[self.active]
+        codes = np.floor((coeffs + self.offset) / self.step).astype(np.int64)
+        return np.clip(codes, 0, self.levels - 1)
+
+    def dequantize(self, codes, out=None):
+        """Integer codes -> k float32 coefficients (zero for components without bits)."""
+        if out is None:
+            out = np.zeros(self.k, dtype=np.float32)
+        else:
+            out.fill(0)
+        out[self.active] = (codes + 0.5) * self.step - self.offset
+        return out
+
+    def encode(self, coeffs, start=0, stop=None):
+        """Pack the codes of coefficients [start, stop) (the whole vector by default)."""
+        lo, hi = self._rows(start, stop)
+        codes = self.quantize(coeffs)[lo:hi]
+        planes = (codes[:, None] >> self.shifts) & 1
+        return np.packbits(planes[self.mask[lo:hi]].astype(np.uint8)).tobytes()
+
+    def decode(self, payload, out=None, start=0, stop=None):
+        """Packed payload (any buffer) for coefficients [start, stop) -> float32 values.
+
+        Returns the full k vector, or fills out[start:stop] when out is given.
+        Each range is independently decodable, so a frame can be split into
+        layers that are sent and lost separately.
+        """
+        stop = self.k if stop is None else stop
+        lo, hi = self._rows(start, stop)
+        mask = self.mask[lo:hi]
+        bits = np.unpackbits(np.frombuffer(payload, dtype=np.uint8), count=int(mask.sum()))
+        planes = np.zeros(mask.shape, dtype=np.int64)
+        planes[mask] = bits
+        codes = (planes << self.shifts).sum(axis=1)
+
+        if out is None:
+            out = np.zeros(self.k, dtype=np.float32)
+        out[start:stop] = 0
+        out[self.active[lo:hi]] = (codes + 0.5) * self.step[lo:hi] - self.offset[lo:hi]
+        return out
+
+
+def quantizer_ladder(eigen_values, budgets=BIT_BUDGET_LADDER):
+    """One quantizer per bit budget, finest first."""
+    return [CoefficientQuantizer(eigen_values, budget) for budget in budgets]
+
+
+def psnr(mse):
+    return 10 * np.log10(255.0 ** 2 / np.maximum(mse, 1e-12))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare float32 and quantized coefficients on a face set")
+    parser.add_argument('basis', help="Eigenbasis (.efb) with eigenvalues")
+    parser.add_argument('faces', help="uint8 N x 120 x 120 face tensor, e.g. dataset.py's faces.npy")
+    parser.add_argument('--k', type=int, default=700)
+    parser.add_argument('--bits', type=int, default=BIT_BUDGET)
+    parser.add_argument('--limit', type=int, default=1000)
+
+    args = parser.parse_args()
+
+    basis = open_basis(args.basis, args.k)
+    if basis.eigen_values is None:
+        raise SystemExit(f"{args.basis} has no eigenvalues; retrain or convert with --eigen_values")
+    codec = EigenfaceCodec(basis)
+    quantizer = CoefficientQuantizer(basis.eigen_values, args.bits)
+
+    faces = np.load(args.faces, mmap_mode='r')[:args.limit]
+    coeffs, _, float_mse = codec.encode_decode(faces)
+    quantized = np.stack([quantizer.decode(quantizer.encode(c)) for c in coeffs])
+    decoded = codec.decode(quantized).reshape(len(faces), -1).astype(np.float32)
+    quant_mse = np.mean((faces.reshape(len(faces), -1).astype(np.float32) - decoded) ** 2, axis=1)
+
+    print(f"float32:   {args.k * 4} bytes/face, PSNR {np.mean(psnr(float_mse)):.2f} dB")
+    print(f"quantized: {quantizer.nbytes} bytes/face ({len(quantizer.active)} components), "
+          f"PSNR {np.mean(psnr(quant_mse)):.2f} dB")
@@ -0,0 +1,53 @@
+import numpy as np
+
+###################################### VARIABLES ######################################
+
+TARGET_PSNR = 32.0  # dB, per face
+MIN_COEFFICIENTS = 16
+
+########################################################################################
+
+
+def psnr_to_mse(psnr):
+    return 255.0 ** 2 / 10 ** (psnr / 10)
+
+
+def prefix_mse(coeffs, energy, dim, quantizer=None):
+    """MSE of every prefix length: column j is the per-face MSE when keeping coefficients [0, j].
+
+    With an orthonormal basis the residual after j coefficients is
+    ||face - mean||^2 minus the cumulative coefficient energy. With a
+    quantizer, components without bits contribute nothing and the rest
+    pay their expected quantization noise (step^2 / 12).
+    """
+    gain = np.asarray(coeffs, dtype=np.float64) ** 2
+    if quantizer is not None:
+        gain = gain - quantizer.noise[:gain.shape[1]]
+        gain[:, quantizer.bits[:gain.shape[1]] == 0] = 0
+    return (np.asarray(energy, dtype=np.float64)[:, None] - np.cumsum(gain, axis=1)) / dim
+
+
+class QualityRateController:
+    """Pick, per face, the fewest leading coefficients that meet a PSNR target."""
+
+    def __init__(self, dim, target_psnr=TARGET_PSNR, k_min=MIN_COEFFICIENTS, k_max=None, quantizer=None):
+        self.dim = dim
+        self.k_min = k_min
+        self.k_max = k_max
+        self.quantizer = quantizer
+        self.set_target(target_psnr)
+
+    def set_target(self, target_psnr):
+        self.target_psnr = target_psnr
+        self.target_mse = psnr_to_mse(target_psnr)
+
+    def choose_k(self, coeffs, energy):
+        """coeffs: B x K projections, energy: ||face - mean||^2 per face (EigenfaceCodec.encode).
+
+        Returns a length-B int array; faces that cannot reach the target get k_max.
+        """
+        k_max = coeffs.shape[1] if self.k_max is None else min(self.k_max, coeffs.shape[1])
+        mse = prefix_mse(coeffs[:, :k_max], energy, self.dim, self.quantizer)
+        meets = mse <= self.target_mse
+        k = np.where(meets.any(axis=1), meets.argmax(axis=1) + 1, k_max)
+        return np.clip(k, min(self.k_min, k_max), k_max)
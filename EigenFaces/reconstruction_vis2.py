@@ -1,145 +1,159 @@
 import cv2
 import numpy as np
-from ultralytics import YOLO
+import os
+import time
+
+from basis import ensure_basis, open_basis
+from codec import CodecBuffers, EigenfaceCodec, crop_faces
+from detection import make_detector, RegionDetector
+from gallery import Gallery
+from ivf import IVFPQIndex
+from overlay import Overlay
+from pipeline import BufferPool, Pipeline
+from tracking import DetectionScheduler
 
 ###################################### VARIABLES ######################################
 
 top_k_eigenfaces = 700  # Number of top eigenfaces to use for compression
 
-# YOLOv8 face detection model
-model = YOLO("./yolov8n-face-lindevs.pt")
-
-# Load precomputed eigenfaces and mean face in grayscale
-eigenfaces = np.load("./eigen_faces.npy").astype(np.float32)  # Eigenfaces matrix
-eigenfaces = eigenfaces[:, :top_k_eigenfaces]  # Use only top k eigenfaces
-mean_face = np.load("./mean_faces.npy")  # Mean face vector
+# YOLOv8 face detection model: "ultralytics" (PyTorch), or "onnxruntime" / "opencv" on an ONNX export of it
+DETECTOR_BACKEND = "ultralytics"
+detector = make_detector(DETECTOR_BACKEND, "./yolov8n-face-lindevs.pt")
+# Full detection every few frames, template tracking in between. The detector itself
+# searches a downscaled frame, or the window around the last faces when it has them
+DETECTION_SCALE = 0.5
+scheduler = DetectionScheduler(RegionDetector(detector, DETECTION_SCALE))
+
+# Memory-map precomputed eigenfaces and mean face (already float32 and truncated)
+basis_path = ensure_basis("./eigen_faces.efb", "./eigen_faces.npy", "./mean_faces.npy")
+top_k_eigenfaces = min(top_k_eigenfaces, open_basis(basis_path).k)  # Use only top k eigenfaces
+basis = open_basis(basis_path, top_k_eigenfaces)
+codec = EigenfaceCodec(basis)
+
+# Enrolled faces to identify (python gallery.py enroll ...; same basis), or None. A directory
+# is an approximate IVF-PQ index (python ivf.py build ...) for galleries too large to scan
+GALLERY_PATH = None
+if not GALLERY_PATH:
+    gallery = None
+elif os.path.isdir(GALLERY_PATH):
+    gallery = IVFPQIndex.load(GALLERY_PATH)
+else:
+    gallery = Gallery.load(GALLERY_PATH)
+
+# Camera index, or a recorded video file to play through the pipeline instead
+VIDEO_SOURCE = 0
+# No window: run until the video ends and print the pipeline stats (see benchmark.py for JSON reports)
+HEADLESS = False
 
 ########################################################################################
 
 # Initialize video capture
-cap = cv2.VideoCapture(0)
+cap = cv2.VideoCapture(VIDEO_SOURCE)
+
+# Per-frame arrays are allocated once and reused: codec buffers travel with each item
+# through the pipeline and come back to the pool after rendering
+buffer_pool = BufferPool(lambda: CodecBuffers(codec))
+gray_frame = None
+
+# Layout: the frames, borders and fixed label are drawn once into the overlay
+# template; per frame only the two face tiles and the changing labels are redrawn
+background = np.empty((500, 800, 3), dtype=np.uint8)
+background[:] = (30, 30, 30)  # Dark gray background, shown while there is no face
+center_x = background.shape[1] // 2
+center_y = background.shape[0] // 2
+box_size = 200  # Face box size
+border_thickness = 10  # Thickness of the colored frame
+frame_color = (255, 0, 0)  # Blue frame (changeable)
+
+# Define positions for left (original) and right (reconstructed) boxes
+left_box = (center_x - box_size - 20, center_y - box_size // 2)
+right_box = (center_x + 20, center_y - box_size // 2)
+
+overlay = Overlay(*background.shape[:2], background=(30, 30, 30))
+for box in (left_box, right_box):
+    # Colored frame, with a white rectangle border for a clean frame effect
+    overlay.template[box[1] - border_thickness:box[1] + box_size + border_thickness,
+                     box[0] - border_thickness:box[0] + box_size + border_thickness] = frame_color
+    cv2.rectangle(overlay.template, 
+                  (box[0] - border_thickness, box[1] - border_thickness), 
+                  (box[0] + box_size + border_thickness, box[1] + box_size + border_thickness), 
+                  (255, 255, 255), thickness=2)
+cv2.putText(overlay.template, "Original", (left_box[0], left_box[1] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+overlay.add_tile("original", left_box[0], left_box[1], box_size)
+overlay.add_tile("reconstructed", right_box[0], right_box[1], box_size)
+overlay.add_text("loss", (right_box[0], right_box[1] - 10), 0.6, (255, 255, 255), 2)
+# Compression percentage at the center below both images
+overlay.add_text("compression", (center_x - 100, center_y + box_size // 2 + 40), 0.6, (255, 255, 255), 2)
+overlay.add_text("identity", (left_box[0], center_y + box_size // 2 + 70), 0.6, (0, 255, 0), 2)
+overlay.build()
+
+def detect(item):
+    """Detection stage: YOLO on the frame and crops of every detected face."""
+    global gray_frame
+    frame = item["frame"]
+
+    # Convert frame to grayscale (into the previous frame's buffer once its size is known)
+    gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=gray_frame)
+
+    # Run YOLO model on the frame, or track the faces it found last time
+    boxes = scheduler(frame, gray_frame)
+
+    item["buffers"] = buffer_pool.acquire()
+    item["faces"], _, item["original_sizes"] = crop_faces(gray_frame, boxes, out=item["buffers"].faces)
+    return item
+
+def encode(item):
+    """Codec stage: the whole batch goes through the codec in one GEMM each way."""
+    coeffs, item["reconstructed_faces"], item["reconstruction_costs"] = codec.encode_decode(item["faces"], item["buffers"])
+    # The projection doubles as the recognition feature: best gallery match per face
+    item["identities"] = gallery.identify(coeffs, top_k=1) if gallery is not None else [[] for _ in coeffs]
+    return item
+
+# Capture, detection and the codec run in their own threads connected by drop-oldest
+# queues, so a slow stage never makes the others wait; this loop only renders
+pipeline = Pipeline(cap, [("detect", detect), ("encode", encode)], pool=buffer_pool).start()
 
 while True:
-    ret, frame = cap.read()
-    if not ret:
-        break
-
-    # Convert frame to grayscale
-    gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-
-    # Create a blank display background (colored background)
-    display_frame = np.full((500, 800, 3), (30, 30, 30), dtype=np.uint8)  # Dark gray background
-    center_x = display_frame.shape[1] // 2
-    center_y = display_frame.shape[0] // 2
-    box_size = 200  # Face box size
-    border_thickness = 10  # Thickness of the colored frame
-    frame_color = (255, 0, 0)  # Blue frame (changeable)
-
-    # Run YOLO model on the frame
-    results = model(frame)
-
-    for result in results:
-        for box in result.boxes:
-            x1, y1, x2, y2 = map(int, box.xyxy[0])  # Convert tensor to int coordinates
-            face = gray_frame[y1:y2, x1:x2]
-            if face.size == 0:
-                continue
-            
-            # Get original face size before resizing
-            original_h, original_w = face.shape[:2]
-            original_face_size = original_h * original_w  # Since it's grayscale
-
-            # Resize face to match PCA eigenface dimensions
-            face_resized = cv2.resize(face, (120, 120))
-
-            # Flatten face to 1D vector
-            face_vector = face_resized.flatten()
-
-            # Subtract mean face for normalization
-            face_normalized = face_vector - mean_face
-
-            # PCA Compression: Project onto eigenfaces
-            compressed_representation = eigenfaces.T @ face_normalized
-
-            # PCA Decompression: Reconstruct the face
-            reconstructed_face = eigenfaces @ compressed_representation + mean_face
-
-            # Reshape back to image dimensions and clip values
-            reconstructed_face = np.clip(reconstructed_face.reshape(120, 120), 0, 255).astype(np.uint8)
-
-            # Compute reconstruction error (MSE)
-            reconstruction_cost = np.mean((face_resized - reconstructed_face) ** 2)
-#################################################################################################################
-            face_vector = face_resized.flatten().astype(np.float32)  # Ensure float32 before mean subtraction
-
-            compressed_representation = eigenfaces.T @ face_normalized
-
-            reconstructed_face = eigenfaces @ compressed_representation + mean_face
-            reconstructed_face = np.clip(reconstructed_face.reshape(120, 120), 0, 255).astype(np.uint8)
-
-            # Ensure float32 before computing MSE
-            reconstruction_cost = np.mean((face_resized.astype(np.float32) - reconstructed_face.astype(np.float32)) ** 2)
-
-
-            # Compute compression percentage dynamically
-            compressed_size = top_k_eigenfaces * 4  # Each PCA coefficient = 4 bytes (float32)
-            if original_face_size > 0:
-                compression_percentage = (1 - (compressed_size / original_face_size)) * 100
-            else:
-                compression_percentage = 0  # Avoid division by zero
-
-            # Ensure compression percentage is within valid bounds (0 to 100)
-            compression_percentage = max(0, min(compression_percentage, 100))
-
-            # Resize for display
-            original_display = cv2.resize(face_resized, (box_size, box_size))
-            reconstructed_display = cv2.resize(reconstructed_face, (box_size, box_size))
-
-            # Convert grayscale images to BGR for colored frame
-            original_display = cv2.cvtColor(original_display, cv2.COLOR_GRAY2BGR)
-            reconstructed_display = cv2.cvtColor(reconstructed_display, cv2.COLOR_GRAY2BGR)
-
-            # Define positions for left (original) and right (reconstructed) boxes
-            left_box = (center_x - box_size - 20, center_y - box_size // 2)
-            right_box = (center_x + 20, center_y - box_size // 2)
-
-            # Draw colored frame around original image
-            display_frame[left_box[1] - border_thickness:left_box[1] + box_size + border_thickness,
-                          left_box[0] - border_thickness:left_box[0] + box_size + border_thickness] = frame_color
-
-            # Draw colored frame around reconstructed image
-            display_frame[right_box[1] - border_thickness:right_box[1] + box_size + border_thickness,
-                          right_box[0] - border_thickness:right_box[0] + box_size + border_thickness] = frame_color
-
-            # Overlay the faces inside the frames
-            display_frame[left_box[1]:left_box[1] + box_size, left_box[0]:left_box[0] + box_size] = original_display
-            display_frame[right_box[1]:right_box[1] + box_size, right_box[0]:right_box[0] + box_size] = reconstructed_display
-
-            # Draw white rectangle border for a clean frame effect
-            cv2.rectangle(display_frame, 
-                          (left_box[0] - border_thickness, left_box[1] - border_thickness), 
-                          (left_box[0] + box_size + border_thickness, left_box[1] + box_size + border_thickness), 
-                          (255, 255, 255), thickness=2)
-
-            cv2.rectangle(display_frame, 
-                          (right_box[0] - border_thickness, right_box[1] - border_thickness), 
-                          (right_box[0] + box_size + border_thickness, right_box[1] + box_size + border_thickness), 
-                          (255, 255, 255), thickness=2)
-
-            # Draw labels
-            cv2.putText(display_frame, "Original", (left_box[0], left_box[1] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-            cv2.putText(display_frame, f"Reconstructed (Loss: {reconstruction_cost:.2f})", 
-                        (right_box[0], right_box[1] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-
-            # Positioning the compression percentage text at the center below both images
-            text_position = (center_x - 100, center_y + box_size // 2 + 40)
-            cv2.putText(display_frame, f"Compression: {compression_percentage:.2f}%", 
-                        text_position, cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+    item = pipeline.get()
+    if item is None:
+        if pipeline.finished or not HEADLESS and cv2.waitKey(1) & 0xFF == ord('q'):
+            break
+        continue
+    render_start = time.monotonic()
+
+    display_frame = overlay.canvas if len(item["faces"]) else background
+    for face_resized, reconstructed_face, reconstruction_cost, original_face_size, matches in zip(
+            item["faces"], item["reconstructed_faces"], item["reconstruction_costs"], item["original_sizes"],
+            item["identities"]):
+        # Compute compression percentage dynamically
+        compressed_size = top_k_eigenfaces * 4  # Each PCA coefficient = 4 bytes (float32)
+        if original_face_size > 0:
+            compression_percentage = (1 - (compressed_size / original_face_size)) * 100
+        else:
+            compression_percentage = 0  # Avoid division by zero
+
+        # Ensure compression percentage is within valid bounds (0 to 100)
+        compression_percentage = max(0, min(compression_percentage, 100))
+
+        # Overlay the faces inside the frames and update the labels (the last face ends up on screen)
+        overlay.set_tile("original", face_resized)
+        overlay.set_tile("reconstructed", reconstructed_face)
+        overlay.set_text("loss", f"Reconstructed (Loss: {reconstruction_cost:.2f})")
+        overlay.set_text("compression", f"Compression: {compression_percentage:.2f}%")
+        if gallery is not None:
+            overlay.set_text("identity", f"{matches[0][0]} ({matches[0][1]:.2f})" if matches else "Unknown")
 
     # Show the frame
-    cv2.imshow("Face PCA Compression (Grayscale with Frame)", display_frame)
-    if cv2.waitKey(1) & 0xFF == ord('q'):
+    if not HEADLESS:
+        cv2.imshow("Face PCA Compression (Grayscale with Frame)", display_frame)
+    pipeline.rendered(item, render_start)
+    pipeline.log_stats()
+    if not HEADLESS and cv2.waitKey(1) & 0xFF == ord('q'):
         break
 
+pipeline.stop()
 cap.release()
-cv2.destroyAllWindows()
+if HEADLESS:
+    print(pipeline.summary())
+else:
+    cv2.destroyAllWindows()
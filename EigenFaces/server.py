@@ -1,23 +1,59 @@
 import cv2
 import numpy as np
+import selectors
 import socket
-import pickle
 import threading
-from ultralytics import YOLO
+import time
+
+from basis import ensure_basis, open_basis
+from codec import CodecBuffers, EigenfaceCodec, crop_faces
+from detection import make_detector, RegionDetector
+from overlay import Overlay
+from feedback import CongestionController, OPERATING_POINTS, PING_INTERVAL, REPORT_INTERVAL, ReceiverStats
+from pipeline import BufferPool, Pipeline
+from protocol import (CoefficientRing, FLAG_KEYFRAME_REQUEST, FLAG_PING, FLAG_PONG, FLAG_REPORT,
+                      pack_keyframe_request, pack_layers, pack_ping, pack_pong, pack_report, unpack_report)
+from quantize import quantizer_ladder
+from ratecontrol import QualityRateController
+from temporal import delta_quantizer_ladder, TemporalEncoder
+from tracking import DetectionScheduler
 
 ###################################### VARIABLES ######################################
 
 top_k_eigenfaces = 700  
 
-model = YOLO("./yolov8n-face-lindevs.pt")  # Face detection model
+# Face detection model: "ultralytics" (PyTorch), or "onnxruntime" / "opencv" on an ONNX export of it
+DETECTOR_BACKEND = "ultralytics"
+detector = make_detector(DETECTOR_BACKEND, "./yolov8n-face-lindevs.pt")
+# Full detection every few frames, template tracking in between. The detector itself
+# searches a downscaled frame, or the window around the last faces when it has them
+DETECTION_SCALE = 0.5
+scheduler = DetectionScheduler(RegionDetector(detector, DETECTION_SCALE))
+
+basis = open_basis(ensure_basis("./eigen_faces_f.efb", "./eigen_faces_f.npy", "./mean_faces_f.npy"), top_k_eigenfaces)
+codec = EigenfaceCodec(basis)
 
-eigenfaces = np.load("./eigen_faces_f.npy").astype(np.float32)
-eigenfaces = eigenfaces[:, :top_k_eigenfaces]
+# Rate-distortion quantizers for the coefficients, finest first (both peers must use the same basis and ladder)
+quantizers = quantizer_ladder(basis.eigen_values) if basis.eigen_values is not None else None
+delta_quantizers = delta_quantizer_ladder(basis.eigen_values) if basis.eigen_values is not None else None
+quantizer = quantizers[0] if quantizers else None
+delta_quantizer = delta_quantizers[0] if delta_quantizers else None
 
-mean_face = np.load("./mean_faces_f.npy")
+# Inter-frame coding: deltas against the last sent frame, keyframes periodically and on request
+encoder = TemporalEncoder(basis.dim, quantizer, delta_quantizer)
+KEYFRAME_REQUEST_INTERVAL = 0.2  # Seconds between repeated keyframe requests
 
-if mean_face.ndim > 1:
-    mean_face = mean_face.flatten()  # Ensure it's a 1D vector
+# Per-frame quality control: send the fewest coefficients that reach the target PSNR
+TARGET_PSNR = 32.0
+rate_controller = QualityRateController(basis.dim, TARGET_PSNR, quantizer=quantizer)
+
+# Congestion control: loss/jitter reports and ping RTTs pick the quantizer, coefficient cap and frame rate
+if quantizers:
+    frame_bytes = [quantizers[p.level].payload_size(0, p.k_max) for p in OPERATING_POINTS]
+else:
+    frame_bytes = [min(p.k_max, top_k_eigenfaces) * 4 for p in OPERATING_POINTS]
+congestion = CongestionController(frame_bytes)
+receiver_stats = ReceiverStats()
 
 # Network Config
 IP = "10.1.37.194"  # Server IP
@@ -29,129 +65,217 @@ FRIEND_NAME = "Friend"
 
 ########################################################################################
 
-BUFFER_SIZE = 65536
-
 # Initialize socket
 server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 server_socket.bind((IP, PORT))
-server_socket.setblocking(False)  # Non-blocking mode
+server_socket.setblocking(False)  # Non-blocking mode; the receiver thread waits on a selector
 print(f"Server listening on {IP}:{PORT}")
 
 # Video Capture
 cap = cv2.VideoCapture(0)
 
-# Global variables for received data
-received_compressed_face = None
+# Received frames are decoded in place into a preallocated ring
+ring = CoefficientRing(top_k_eigenfaces, quantizers, delta_quantizers)
 received_addr = None
+send_seq = 0
+last_send = last_ping = last_report = 0.0
+
+# Guards the ring and receiver stats shared by the receiver thread and the render loop
+receive_lock = threading.Lock()
+
+# Per-frame arrays are allocated once and reused: codec buffers travel with each item
+# through the pipeline and come back to the pool after rendering; the detection stage,
+# the receiver-side decode and the display each own their scratch arrays
+buffer_pool = BufferPool(lambda: CodecBuffers(codec, max_faces=1))  # Only one face is sent
+gray_frame = None
+received_coeffs = np.zeros(top_k_eigenfaces, dtype=np.float32)
+render_buffers = CodecBuffers(codec, max_faces=1)
+blank_face = np.zeros((120, 120), dtype=np.uint8)
+
+# The window chrome (background, borders, names) is drawn once; each frame only
+# updates the two face tiles and repaints text fields whose value changed
+sender_pos = (95, 145)
+receiver_pos = (495, 145)
+border_thickness = 5
+overlay = Overlay(500, 800)  # Black background
+for (x, y), name in ((sender_pos, YOUR_NAME), (receiver_pos, FRIEND_NAME)):
+    overlay.template[y:y+210, x:x+210] = 255  # White border
+    cv2.putText(overlay.template, name, (x + 20, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+overlay.add_tile("sender", sender_pos[0] + border_thickness, sender_pos[1] + border_thickness, 200)
+overlay.add_tile("receiver", receiver_pos[0] + border_thickness, receiver_pos[1] + border_thickness, 200)
+overlay.add_text("cost", (sender_pos[0] + 10, sender_pos[1] + 230), 0.6, (255, 255, 255), 2)
+overlay.add_text("compression", (300, 450), 0.7, (255, 255, 255), 2)
+overlay.add_text("no_face", (300, 480), 0.9, (0, 0, 255), 2)
+overlay.build()
+
+def handle_datagram(header, addr):
+    global received_addr
+    if header is None:
+        return
+    if header.flags & FLAG_KEYFRAME_REQUEST:
+        encoder.request_keyframe()
+    elif header.flags & FLAG_PING:
+        server_socket.sendto(pack_pong(header), addr)
+    elif header.flags & FLAG_PONG:
+        congestion.on_pong(header.timestamp_us)
+    elif header.flags & FLAG_REPORT:
+        try:
+            _, fraction_lost, jitter_us = unpack_report(ring.payload(header))
+        except ValueError:
+            return
+        congestion.on_report(fraction_lost, jitter_us)
+    else:
+        received_addr = addr
+        receiver_stats.on_datagram(header)
 
 def receive_data():
-    global received_compressed_face, received_addr
+    """Sleep in the selector until datagrams arrive, then drain the socket; no CPU is used while idle."""
+    selector = selectors.DefaultSelector()
+    selector.register(server_socket, selectors.EVENT_READ)
+    last_keyframe_request = 0.0
     while True:
-        try:
-            data, addr = server_socket.recvfrom(BUFFER_SIZE)
-            received_compressed_face = pickle.loads(data)
-            received_addr = addr
-        except BlockingIOError:
-            continue
+        # Wake up at least every KEYFRAME_REQUEST_INTERVAL so lost keyframe requests get repeated
+        if selector.select(timeout=KEYFRAME_REQUEST_INTERVAL):
+            while True:
+                try:
+                    with receive_lock:
+                        header, addr = ring.receive(server_socket)
+                        handle_datagram(header, addr)
+                except (BlockingIOError, InterruptedError):
+                    break  # Drained
+                except ConnectionResetError:
+                    continue  # ICMP port unreachable from the peer (Windows); keep reading
+        if ring.keyframe_needed and received_addr is not None \
+                and time.monotonic() - last_keyframe_request > KEYFRAME_REQUEST_INTERVAL:
+            server_socket.sendto(pack_keyframe_request(), received_addr)
+            last_keyframe_request = time.monotonic()
 
 # Start receiver thread
 recv_thread = threading.Thread(target=receive_data, daemon=True)
 recv_thread.start()
 
-while True:
-    ret, frame = cap.read()
-    if not ret:
-        break
-    
-    # Convert to grayscale
-    gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+def detect(item):
+    """Detection stage: YOLO on the frame and a crop of the first usable face."""
+    global gray_frame
+    frame = item["frame"]
+
+    # Convert to grayscale (into the previous frame's buffer once its size is known)
+    gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=gray_frame)
 
-    results = model(frame)  # Run YOLO on original frame
-    face_detected = False
-    face_resized = np.zeros((120, 120), dtype=np.uint8)
+    boxes = scheduler(frame, gray_frame)  # YOLO on a reduced frame, or the tracker in between
+    item["face_detected"] = len(boxes) > 0
+
+    # Only the first usable face is sent on the call; it is cropped straight into the item's buffers
+    item["buffers"] = buffer_pool.acquire()
+    item["faces"], _, _ = crop_faces(gray_frame, boxes, out=item["buffers"].faces)
+    return item
+
+def encode_and_send(item):
+    """Encode stage: feedback channel, rate and congestion control, PCA encoding and sending."""
+    global send_seq, last_send, last_ping, last_report
+
+    # Feedback channel: RTT probes to the friend, loss/jitter reports on what we received
+    now = time.monotonic()
+    if now - last_ping > PING_INTERVAL:
+        server_socket.sendto(pack_ping(), (FRIEND_IP, PORT))
+        last_ping = now
+    if received_addr is not None and now - last_report > REPORT_INTERVAL:
+        with receive_lock:
+            report = receiver_stats.report()
+        if report is not None:
+            server_socket.sendto(pack_report(*report), received_addr)
+        last_report = now
+
+    # Apply the operating point congestion control allows
+    point = congestion.operating_point()
+    rate_controller.k_max = point.k_max
+    if quantizers:
+        encoder.set_quantizers(quantizers[point.level], delta_quantizers[point.level], point.level)
+        rate_controller.quantizer = quantizers[point.level]
+    face_resized = blank_face
     sender_reconstruction_cost = None 
+    compressed_size = None
+
+    faces, buffers = item["faces"], item["buffers"]
+    if len(faces):
+        # PCA Compression; the sender cost comes from the residual energy, no reconstruction needed
+        compressed_faces, energy = codec.encode(faces, return_energy=True, buffers=buffers)
+        k = int(rate_controller.choose_k(compressed_faces, energy)[0])
+        face_resized = faces[0]
+        sender_reconstruction_cost = codec.estimate_errors(energy, compressed_faces[:, :k], buffers)[0]
+
+        # Send the first k coefficients to friend, skipping the face when it barely changed
+        # or when the frame rate allowed by congestion control has been used up
+        encoded = None
+        if now - last_send >= 1 / point.fps:
+            encoded = encoder.encode(compressed_faces[0], k)
+        if encoded is not None:
+            last_send = now
+            dtype, k, flags, layers = encoded
+            compressed_size = sum(len(payload) for _, _, payload in layers)
+            # Base layer first, then enhancement layers as separate datagrams
+            for datagram in pack_layers(send_seq, dtype, k, layers, flags=flags):
+                server_socket.sendto(datagram, (FRIEND_IP, PORT))
+            send_seq += 1
+
+    item["face_resized"] = face_resized
+    item["sender_reconstruction_cost"] = sender_reconstruction_cost
+    item["compressed_size"] = compressed_size
+    return item
+
+# Capture, detection and encoding run in their own threads connected by drop-oldest
+# queues, so a slow stage never makes the others wait; this loop only renders
+pipeline = Pipeline(cap, [("detect", detect), ("encode", encode_and_send)], pool=buffer_pool).start()
+
+while True:
+    item = pipeline.get()
+    if item is None:
+        if pipeline.finished or cv2.waitKey(1) & 0xFF == ord('q'):
+            break
+        continue
+    render_start = time.monotonic()
+    face_detected = item["face_detected"]
+    face_resized = item["face_resized"]
+    sender_reconstruction_cost = item["sender_reconstruction_cost"]
+    compressed_size = item["compressed_size"]
     
-    for result in results:
-        for box in result.boxes:
-            face_detected = True
-            x1, y1, x2, y2 = map(int, box.xyxy[0])
-            face = gray_frame[y1:y2, x1:x2] 
-            if face.size == 0:
-                continue
-            
-            face_resized = cv2.resize(face, (120, 120))
-            face_flatten = face_resized.flatten().astype(np.float32)
-            face_normalized = face_flatten - mean_face
-            
-            # PCA Compression: Project onto eigenfaces
-            compressed_face = eigenfaces.T @ face_normalized
-            
-            # Sender-side PCA Reconstruction
-            sender_reconstructed = eigenfaces @ compressed_face + mean_face
-            sender_reconstructed_clipped = np.clip(sender_reconstructed.reshape(120, 120), 0, 255).astype(np.uint8)
-            sender_reconstruction_cost = np.mean((face_resized.astype(np.float32) - sender_reconstructed_clipped.astype(np.float32))**2)
-            
-            # Send compressed face to friend
-            face_data = pickle.dumps(compressed_face)
-            server_socket.sendto(face_data, (FRIEND_IP, PORT))
-            break  # Process only the first detected face
-    
-    # Receiver-side reconstruction (for display only)
+    # Receiver-side reconstruction (for display only); take a snapshot so the receiver
+    # thread can keep decoding into the ring while we reconstruct
+    with receive_lock:
+        received_header, latest_coeffs = ring.latest()
+        received_compressed_face = None
+        if latest_coeffs is not None:
+            # Coefficients past the frame's k are zero, so only the first k eigenfaces are needed
+            received_compressed_face = received_coeffs[:received_header.k]
+            np.copyto(received_compressed_face, latest_coeffs[:received_header.k])
     if received_compressed_face is not None:
-        receiver_reconstructed = eigenfaces @ received_compressed_face + mean_face
-        receiver_reconstructed_clipped = np.clip(receiver_reconstructed.reshape(120, 120), 0, 255).astype(np.uint8)
+        receiver_reconstructed_clipped = codec.decode(received_compressed_face, render_buffers)[0]
     else:
-        receiver_reconstructed_clipped = np.zeros((120, 120), dtype=np.uint8)
+        receiver_reconstructed_clipped = blank_face
 
     # Calculate compression ratio
     # Original face size in bytes (120x120 grayscale, each pixel 1 byte)
     original_face_size = 120 * 120  
-    compressed_size = top_k_eigenfaces * 4  # Each PCA coefficient as float32 (4 bytes)
+    if compressed_size is None:  # Nothing sent this frame: report the full-quality payload
+        compressed_size = quantizer.nbytes if quantizer is not None else top_k_eigenfaces * 4
     compression_ratio = (1 - (compressed_size / original_face_size)) * 100
 
-    # Display Both Faces
-    display_frame = np.zeros((500, 800, 3), dtype=np.uint8)  # Black background
-    original_display = cv2.resize(face_resized, (200, 200))  # Sender's original face
-    reconstructed_display = cv2.resize(receiver_reconstructed_clipped, (200, 200))  # Receiver's reconstructed face
-
-    # Convert grayscale images to 3-channel for display
-    original_display = cv2.cvtColor(original_display, cv2.COLOR_GRAY2BGR)
-    reconstructed_display = cv2.cvtColor(reconstructed_display, cv2.COLOR_GRAY2BGR)
-
-    # Add white border to images
-    border_thickness = 5
-    original_display = cv2.copyMakeBorder(original_display, border_thickness, border_thickness, border_thickness, border_thickness, 
-                                          cv2.BORDER_CONSTANT, value=(255, 255, 255))
-    reconstructed_display = cv2.copyMakeBorder(reconstructed_display, border_thickness, border_thickness, border_thickness, border_thickness, 
-                                               cv2.BORDER_CONSTANT, value=(255, 255, 255))
-
-    # Set positions for display
-    sender_pos = (95, 145)
-    receiver_pos = (495, 145)
-    display_frame[sender_pos[1]:sender_pos[1]+210, sender_pos[0]:sender_pos[0]+210] = original_display
-    display_frame[receiver_pos[1]:receiver_pos[1]+210, receiver_pos[0]:receiver_pos[0]+210] = reconstructed_display
-    
-    # Add labels above boxes
-    cv2.putText(display_frame, YOUR_NAME, (sender_pos[0] + 20, sender_pos[1] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-    cv2.putText(display_frame, FRIEND_NAME, (receiver_pos[0] + 20, receiver_pos[1] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-    
-    # Add sender reconstruction cost below the sender image
-    if sender_reconstruction_cost is not None:
-        cv2.putText(display_frame, f"Cost: {sender_reconstruction_cost:.2f}", 
-                    (sender_pos[0] + 10, sender_pos[1] + 230), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-    
-    # Add compression ratio below both images (centered)
-    cv2.putText(display_frame, f"Compression: {compression_ratio:.2f}%", 
-                (300, 450), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+    # Display Both Faces: only the tiles and changed labels are redrawn
+    overlay.set_tile("sender", face_resized)
+    overlay.set_tile("receiver", receiver_reconstructed_clipped)
     
-    # Show message if no face detected
-    if not face_detected:
-        cv2.putText(display_frame, "No Face Detected", (300, 480), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 255), 2)
+    # Sender reconstruction cost below the sender image, compression ratio below both
+    overlay.set_text("cost", f"Cost: {sender_reconstruction_cost:.2f}" if sender_reconstruction_cost is not None else "")
+    overlay.set_text("compression", f"Compression: {compression_ratio:.2f}%")
+    overlay.set_text("no_face", "" if face_detected else "No Face Detected")
     
-    cv2.imshow("Friend Video Call", display_frame)
+    cv2.imshow("Friend Video Call", overlay.canvas)
+    pipeline.rendered(item, render_start)
+    pipeline.log_stats()
     if cv2.waitKey(1) & 0xFF == ord('q'):   
         break
 
+pipeline.stop()
 cap.release()
 cv2.destroyAllWindows()
 server_socket.close()
@@ -0,0 +1,100 @@
+import numpy as np
+
+from protocol import encode_payload, FLAG_DELTA, FLAG_KEYFRAME, layer_ranges
+from quantize import BIT_BUDGET_LADDER, CoefficientQuantizer
+
+###################################### VARIABLES ######################################
+
+KEYFRAME_INTERVAL = 30  # Input frames between forced keyframes
+SKIP_MSE = 2.0  # Don't transmit when the face changed by less than this (pixel MSE)
+DELTA_VARIANCE_RATIO = 0.05  # Expected delta variance relative to the eigenvalues
+DELTA_BIT_BUDGET = 1024
+KEYFRAME_ENERGY_RATIO = 0.5  # Send a keyframe instead when the delta is this large
+
+########################################################################################
+
+
+def delta_quantizer_for(eigen_values, bit_budget=DELTA_BIT_BUDGET):
+    """Quantizer tuned for inter-frame differences rather than absolute coefficients."""
+    return CoefficientQuantizer(np.asarray(eigen_values) * DELTA_VARIANCE_RATIO, bit_budget)
+
+
+def delta_quantizer_ladder(eigen_values, budgets=BIT_BUDGET_LADDER):
+    """Delta quantizers matching quantize.quantizer_ladder, at half of each keyframe budget."""
+    return [delta_quantizer_for(eigen_values, budget // 2) for budget in budgets]
+
+
+class TemporalEncoder:
+    """Inter-frame coefficient coder with periodic and on-demand keyframes.
+
+    The encoder tracks the receiver's reconstruction (closed loop), so
+    quantization error never accumulates across deltas. encode returns
+    (dtype, k, flags, layers) with one (start, stop, payload) entry per
+    layer (see protocol.pack_layers), or None when the frame should be skipped.
+    Sequence numbers must only advance for frames that are actually sent,
+    since the receiver applies a delta to frame seq - 1.
+    """
+
+    def __init__(self, dim, quantizer=None, delta_quantizer=None, keyframe_interval=KEYFRAME_INTERVAL,
+                 skip_mse=SKIP_MSE):
+        self.dim = dim  # Pixels per face; ||delta||^2 / dim is the pixel MSE of the change
+        self.quantizer = quantizer
+        self.delta_quantizer = delta_quantizer
+        self.keyframe_interval = keyframe_interval
+        self.skip_mse = skip_mse
+        self.reference = None
+        self.frames_since_keyframe = 0
+        self.keyframe_requested = False
+        self.level = 0  # Rung of the quantizer ladder, sent with every quantized payload
+
+    def set_quantizers(self, quantizer, delta_quantizer, level=0):
+        """Switch quantization depth between frames; the closed loop absorbs the change."""
+        self.quantizer = quantizer
+        self.delta_quantizer = delta_quantizer
+        self.level = level
+
+    def request_keyframe(self):
+        """Called (from any thread) when the receiver reports a broken delta chain."""
+        self.keyframe_requested = True
+
+    def _quantize(self, values, quantizer, k):
+        """Encode the layers covering values[:k]; also returns what the receiver will decode."""
+        layers = []
+        for start, stop in layer_ranges(k):
+            dtype, payload = encode_payload(values, quantizer, start, stop, self.level)
+            layers.append((start, stop, payload))
+        if quantizer is None:
+            decoded = np.array(values, dtype=np.float32)
+        else:
+            decoded = quantizer.dequantize(quantizer.quantize(values))
+        decoded[k:] = 0
+        return dtype, k, layers, decoded
+
+    def encode(self, coeffs, k=None):
+        """Encode the first k coefficients (all by default); the rest are zero on the receiver."""
+        coeffs = np.array(coeffs, dtype=np.float32)
+        k = len(coeffs) if k is None else int(k)
+        coeffs[k:] = 0
+        self.frames_since_keyframe += 1
+
+        keyframe = (self.reference is None or self.keyframe_requested
+                    or self.frames_since_keyframe >= self.keyframe_interval)
+        if not keyframe:
+            delta = coeffs - self.reference
+            delta_energy = float(np.dot(delta, delta))
+            if delta_energy / self.dim < self.skip_mse:
+                return None
+            keyframe = delta_energy > KEYFRAME_ENERGY_RATIO * float(np.dot(coeffs, coeffs))
+
+        if keyframe:
+            dtype, k, layers, decoded = self._quantize(coeffs, self.quantizer, k)
+            self.reference = decoded
+            self.frames_since_keyframe = 0
+            self.keyframe_requested = False
+            return dtype, k, FLAG_KEYFRAME, layers
+
+        delta[k:] = 0  # The receiver zeroes everything past k itself
+        dtype, k, layers, decoded = self._quantize(delta, self.delta_quantizer, k)
+        self.reference = self.reference + decoded
+        self.reference[k:] = 0
+        return dtype, k, FLAG_DELTA, layers
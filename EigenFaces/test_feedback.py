@@ -0,0 +1,44 @@
+import time
+from collections import deque
+
+import numpy as np
+
+from feedback import (CongestionController, FEEDBACK_TIMEOUT, MIN_RTT_WINDOW, monotonic_us, OPERATING_POINTS,
+                      ReceiverStats)
+from protocol import pack_frame, unpack_header
+
+
+def frame_header(seq):
+    return unpack_header(pack_frame(seq, np.zeros(10, dtype=np.float32))[0])
+
+
+def test_outage_sends_no_report_and_controller_backs_off():
+    stats = ReceiverStats()
+    stats.on_datagram(frame_header(0))
+    assert stats.report() is not None
+    assert stats.report() is None  # Nothing arrived: no "0% loss" report
+
+    congestion = CongestionController([100] * len(OPERATING_POINTS))
+    congestion.on_report(0.0, 0.0)
+    start_rate = congestion.rate
+    for _ in range(3):  # The outage: reports stop coming, so the rate is not raised
+        report = stats.report()
+        if report is not None:
+            congestion.on_report(*report[1:])
+    assert congestion.rate == start_rate
+    congestion.last_report = time.monotonic() - FEEDBACK_TIMEOUT - 1
+    assert congestion.operating_point() == OPERATING_POINTS[-1]
+
+
+def test_min_rtt_follows_the_path_after_the_window():
+    congestion = CongestionController([100] * len(OPERATING_POINTS))
+    congestion.on_pong(monotonic_us())  # A 0 s sample, e.g. from a short route
+    assert congestion.min_rtt < 0.01
+    # MIN_RTT_WINDOW later the path has 80 ms RTT; the old minimum must not pin the rate at the floor
+    congestion._rtt_samples = deque((sampled - MIN_RTT_WINDOW - 1, rtt) for sampled, rtt in congestion._rtt_samples)
+    for _ in range(5):
+        congestion.on_pong(monotonic_us() - 80000)
+    assert abs(congestion.min_rtt - 0.08) < 0.01
+    rate = congestion.rate
+    congestion.on_report(0.0, 0.0)
+    assert congestion.rate > rate
@@ -0,0 +1,30 @@
+import cv2
+import numpy as np
+
+from overlay import FONT, Overlay
+
+
+def full_redraw(overlay):
+    """Canvas drawn from scratch: the template plus every field in registration order."""
+    canvas = overlay.template.copy()
+    for field in overlay.texts.values():
+        if field["value"]:
+            cv2.putText(canvas, field["value"], field["origin"], FONT, field["scale"], field["color"],
+                        field["thickness"])
+    return canvas
+
+
+def test_set_text_matches_full_redraw_with_overlapping_fields():
+    overlay = Overlay(120, 400)
+    overlay.template[40:80, :] = (40, 90, 160)  # Chrome under the text, so restoring matters
+    # Three fields close enough that their boxes overlap each other
+    overlay.add_text("a", (10, 60), 0.9, (255, 255, 255), 2)
+    overlay.add_text("b", (60, 70), 0.7, (0, 255, 0), 2)
+    overlay.add_text("c", (120, 55), 0.8, (0, 0, 255), 1)
+    overlay.build()
+
+    rng = np.random.default_rng(0)
+    values = ["", "Loss: 12.34", "Compression: 98.76%", "Unknown", "person7 (0.93)", "WWWWWWWWWWWW"]
+    for _ in range(300):
+        overlay.set_text(str(rng.choice(["a", "b", "c"])), str(rng.choice(values)))
+        np.testing.assert_array_equal(overlay.canvas, full_redraw(overlay))
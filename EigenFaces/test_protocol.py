@@ -0,0 +1,47 @@
+import socket
+
+import numpy as np
+
+from feedback import ReceiverStats
+from protocol import CoefficientRing, pack_frame, unpack_header
+
+
+def send_frames(ring, seqs, value, timestamp_us):
+    """Push one single-layer keyframe per seq through a socket pair into ring; returns the headers."""
+    a, b = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    headers = []
+    with a, b:
+        for i, seq in enumerate(seqs):
+            datagram = pack_frame(seq, np.full(10, value + i, dtype=np.float32), timestamp_us=timestamp_us + i)[0]
+            a.send(datagram)
+            ring.receive(b)
+            headers.append(unpack_header(datagram))
+    return headers
+
+
+def test_restarted_sender_replaces_the_old_stream():
+    ring = CoefficientRing(10)
+    send_frames(ring, range(40), 0, 1000)
+    dropped = ring.dropped
+    send_frames(ring, range(5), 100, 2000)  # Peer restarted: seq from 0 again, later capture times
+    header, coeffs = ring.latest()
+    assert header.seq == 4 and coeffs[0] == 104
+    assert ring.dropped == dropped
+
+
+def test_late_datagram_of_the_running_stream_does_not_reset():
+    ring = CoefficientRing(10)
+    send_frames(ring, range(40), 0, 1000)
+    send_frames(ring, [3], 0, 500)  # Captured before frame 39: just too old
+    assert ring.latest()[0].seq == 39
+    assert ring.dropped == 1
+
+
+def test_receiver_stats_count_a_restart_as_no_loss():
+    stats = ReceiverStats()
+    for headers in (send_frames(CoefficientRing(10), range(40), 0, 1000),
+                    send_frames(CoefficientRing(10), range(5), 0, 2000)):
+        for header in headers:
+            stats.on_datagram(header)
+    highest_seq, fraction_lost, _ = stats.report()
+    assert highest_seq == 4 and fraction_lost == 0.0
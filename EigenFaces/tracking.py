@@ -0,0 +1,169 @@
+"""Cheap face tracking between detector runs.
+
+The YOLO face detector dominates the per-frame cost. DetectionScheduler runs it
+every DETECTION_INTERVAL frames (or sooner when tracking gets unsure) and lets
+FaceTracker carry the boxes in between: each face is found again by template
+matching in a small window around its predicted position, and the box is
+smoothed with a constant-velocity alpha-beta filter (a steady-state Kalman
+filter) so the crop fed to the codec doesn't jitter.
+"""
+import cv2
+import numpy as np
+
+###################################### VARIABLES ######################################
+
+DETECTION_INTERVAL = 5  # Frames between full detector runs
+MIN_TRACK_CONFIDENCE = 0.6  # Normalized template correlation below which we re-detect
+SEARCH_MARGIN = 0.5  # Search window padding, as a fraction of the box size
+TEMPLATE_WIDTH = 32  # Templates and search windows are matched at this scale
+MATCH_IOU = 0.3  # Minimum overlap to treat a detection as an existing track
+
+# Alpha-beta gains: how much a measurement corrects position and velocity
+ALPHA = 0.6
+BETA = 0.2
+
+########################################################################################
+
+
+def box_iou(a, b):
+    """IoU matrix between N x 4 and M x 4 xyxy boxes."""
+    a = np.asarray(a, dtype=np.float32)[:, None]
+    b = np.asarray(b, dtype=np.float32)[None]
+    w = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    h = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    inter = w * h
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    return inter / np.maximum(area_a + area_b - inter, 1e-6)
+
+
+class Track:
+    """One face: smoothed box, per-frame velocity and the template it is matched with."""
+
+    def __init__(self, gray, box):
+        self.box = np.asarray(box, dtype=np.float32)
+        self.velocity = np.zeros(4, dtype=np.float32)
+        self.confidence = 1.0
+        self.set_template(gray)
+
+    def set_template(self, gray):
+        """Clamp the box to the frame and take the template from it; False (and no template) if nothing is left."""
+        h, w = gray.shape[:2]
+        self.box = np.clip(self.box, 0, np.array([w, h, w, h], dtype=np.float32))
+        x1, y1, x2, y2 = self._clip(self.box, gray.shape)
+        if x2 <= x1 or y2 <= y1:
+            self.template = None  # Box lies off the frame
+            return False
+        self.scale = TEMPLATE_WIDTH / (x2 - x1)
+        patch = gray[y1:y2, x1:x2]
+        self.template = cv2.resize(patch, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        return True
+
+    @staticmethod
+    def _clip(box, shape):
+        h, w = shape[:2]
+        x1, y1, x2, y2 = np.round(box).astype(int)
+        return max(x1, 0), max(y1, 0), min(x2, w), min(y2, h)
+
+    def correct(self, predicted, measured):
+        """Alpha-beta update of the box towards a measurement."""
+        residual = measured - predicted
+        self.box = predicted + ALPHA * residual
+        self.velocity = self.velocity + BETA * residual
+
+    def update(self, gray):
+        """Find the face again near its predicted position; returns the match confidence."""
+        predicted = self.box + self.velocity
+        size = predicted[2:] - predicted[:2]
+        margin = SEARCH_MARGIN * size
+        x1, y1, x2, y2 = self._clip(np.concatenate([predicted[:2] - margin, predicted[2:] + margin]), gray.shape)
+        if x2 <= x1 or y2 <= y1:
+            self.confidence = 0.0  # Face ran off the frame
+            return self.confidence
+        window = cv2.resize(gray[y1:y2, x1:x2], None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        th, tw = self.template.shape
+        if window.shape[0] < th or window.shape[1] < tw:
+            self.confidence = 0.0  # Face ran off the frame
+            return self.confidence
+
+        scores = cv2.matchTemplate(window, self.template, cv2.TM_CCOEFF_NORMED)
+        _, self.confidence, _, (mx, my) = cv2.minMaxLoc(scores)
+        origin = np.array([x1 + mx / self.scale, y1 + my / self.scale], dtype=np.float32)
+        # The template keeps the size it was taken at; only the position is measured
+        measured = np.concatenate([origin, origin + predicted[2:] - predicted[:2]])
+        self.correct(predicted, measured)
+        return self.confidence
+
+
+class FaceTracker:
+    """Tracks the detector's boxes from frame to frame."""
+
+    def __init__(self):
+        self.tracks = []
+
+    @property
+    def confidence(self):
+        """Confidence of the least certain track (0 with no tracks)."""
+        return min((track.confidence for track in self.tracks), default=0.0)
+
+    def detected(self, gray, boxes):
+        """Take a fresh detection: match it to the tracks, smooth matched boxes, start/drop the rest."""
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        tracks = []
+        if self.tracks and len(boxes):
+            iou = box_iou(boxes, [track.box for track in self.tracks])
+        for i, box in enumerate(boxes):
+            j = int(np.argmax(iou[i])) if self.tracks else -1
+            if j >= 0 and iou[i, j] >= MATCH_IOU:
+                track = self.tracks[j]
+                iou[:, j] = 0  # Each track matches at most one detection
+                track.correct(track.box + track.velocity, box)
+                track.confidence = 1.0
+                track.set_template(gray)
+            else:
+                track = Track(gray, box)
+            if track.template is not None:  # Boxes that fell off the frame are dropped
+                tracks.append(track)
+        self.tracks = tracks  # Unmatched tracks are gone: the detector is the authority
+
+    def update(self, gray):
+        for track in self.tracks:
+            track.update(gray)
+
+    def boxes(self):
+        """N x 4 int32 xyxy boxes, like codec.face_boxes."""
+        if not self.tracks:
+            return np.zeros((0, 4), dtype=np.int32)
+        return np.round([track.box for track in self.tracks]).astype(np.int32)
+
+
+class DetectionScheduler:
+    """Runs detector(frame) -> boxes only every interval frames, tracking in between.
+
+    Detection also runs whenever there is nothing to track (so a lost face is
+    searched for on every frame) or a track's match confidence on this frame
+    drops below min_confidence.
+    """
+
+    def __init__(self, detector, interval=DETECTION_INTERVAL, min_confidence=MIN_TRACK_CONFIDENCE):
+        self.detector = detector
+        self.interval = interval
+        self.min_confidence = min_confidence
+        self.tracker = FaceTracker()
+        self.frames_since_detection = 0
+        self.detections = 0
+        self.frames = 0
+
+    def __call__(self, frame, gray):
+        """Face boxes for this frame (N x 4 int32 xyxy)."""
+        self.frames += 1
+        if self.tracker.tracks and self.frames_since_detection + 1 < self.interval:
+            self.tracker.update(gray)
+            if self.tracker.confidence >= self.min_confidence:
+                self.frames_since_detection += 1
+                return self.tracker.boxes()
+
+        self.tracker.detected(gray, self.detector(frame))
+        self.frames_since_detection = 0
+        self.detections += 1
+        return self.tracker.boxes()
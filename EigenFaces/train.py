@@ -0,0 +1,486 @@
+import argparse
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+from tqdm import tqdm
+
+from basis import write_basis
+from dataset import decode_image, list_images_by_class, prepare_dataset, target_dim, TENSOR_FILE
+
+###################################### VARIABLES ######################################
+
+CHUNK_SIZE = 500  # Images decoded and folded into the model at a time
+NUM_COMPONENTS = 1000  # Eigenfaces kept (consumers use 700-1000)
+
+# Solver selection: randomized when k is a small fraction of the data rank,
+# otherwise the Gram trick for n <= d and the d x d covariance for n > d
+RANDOMIZED_MAX_FRACTION = 0.25
+OVERSAMPLES = 10  # Extra random directions for the randomized range finder
+POWER_ITERATIONS = 2
+COVARIANCE_MEMORY_FRACTION = 0.8  # Share of available RAM the covariance solver's scatter matrices may take
+SCATTER_BLOCK = 512  # Scatter rows updated at a time, so temporaries stay SCATTER_BLOCK x d
+
+########################################################################################
+
+
+def iter_image_chunks(image_paths, chunk_size=CHUNK_SIZE, dim=target_dim):
+    """Decode and resize images lazily, yielding uint8 arrays of shape (b, h, w)."""
+    chunk = []
+    for path in image_paths:
+        img = decode_image(path, dim)
+        if img is None:
+            print(f"Warning: Could not load image: {path}")
+            continue
+        chunk.append(img)
+        if len(chunk) == chunk_size:
+            yield np.stack(chunk)
+            chunk = []
+    if chunk:
+        yield np.stack(chunk)
+
+
+class IncrementalPCA:
+    """Blocked PCA that only ever holds the current basis and one chunk in memory.
+
+    Each chunk is merged into the running (mean, singular values, components)
+    with a thin SVD of the stacked matrix [S * V; X_chunk - mean_chunk; mean
+    correction], so memory is O((k + chunk) * d) no matter how many images
+    are streamed through it.
+    """
+
+    def __init__(self, n_components=NUM_COMPONENTS):
+        self.n_components = n_components
+        self.n_samples = 0
+        self.mean = None
+        self.components = None  # (k, d), rows sorted by decreasing variance
+        self.singular_values = None
+
+    def partial_fit(self, X):
+        X = np.asarray(X, dtype=np.float64).reshape(len(X), -1)
+        n_batch = X.shape[0]
+        if n_batch == 0:
+            return self
+
+        batch_mean = X.mean(axis=0)
+        n_total = self.n_samples + n_batch
+        X = X - batch_mean
+
+        if self.n_samples == 0:
+            stacked = X
+            new_mean = batch_mean
+        else:
+            # Re-centre the previous basis on the combined mean
+            correction = np.sqrt(self.n_samples * n_batch / n_total) * (self.mean - batch_mean)
+            stacked = np.vstack((self.singular_values[:, None] * self.components, X, correction))
+            new_mean = self.mean + (batch_mean - self.mean) * (n_batch / n_total)
+
+        _, S, Vt = np.linalg.svd(stacked, full_matrices=False)
+        k = min(self.n_components, len(S))
+        self.components = Vt[:k]
+        self.singular_values = S[:k]
+        self.mean = new_mean
+        self.n_samples = n_total
+        return self
+
+    @property
+    def eigen_values(self):
+        # Same normalisation as the notebook's covariance (divide by N)
+        return self.singular_values ** 2 / self.n_samples
+
+
+class ScatterAccumulator:
+    """Running count, mean and d x d scatter matrix of streamed samples.
+
+    The scatter is updated in place a block of rows at a time, so at
+    d = 14400 (1.66 GB in float64) no second d x d matrix is ever allocated.
+    """
+
+    def __init__(self, dim):
+        self.count = 0
+        self.mean = np.zeros(dim)
+        self.scatter = np.zeros((dim, dim))
+
+    @classmethod
+    def from_stats(cls, count, mean, scatter):
+        """Accumulator that takes over existing statistics (scatter is updated in place from then on)."""
+        acc = cls.__new__(cls)
+        acc.count, acc.mean, acc.scatter = count, np.array(mean, dtype=np.float64), scatter
+        return acc
+
+    def _add_gram(self, X):
+        """scatter += X^T X."""
+        for start in range(0, len(self.scatter), SCATTER_BLOCK):
+            self.scatter[start:start + SCATTER_BLOCK] += X[:, start:start + SCATTER_BLOCK].T @ X
+
+    def _add_moments(self, count, mean):
+        """Fold a group's count and mean in, with the rank-1 scatter between the two means."""
+        n_total = self.count + count
+        delta = mean - self.mean
+        self._add_gram(delta[None] * np.sqrt(self.count * count / n_total))
+        self.mean += delta * (count / n_total)
+        self.count = n_total
+
+    def update(self, X):
+        X = np.asarray(X, dtype=np.float64).reshape(len(X), -1)
+        if len(X):
+            batch_mean = X.mean(axis=0)
+            self._add_gram(X - batch_mean)
+            self._add_moments(len(X), batch_mean)
+        return self
+
+    def add(self, count, mean, scatter):
+        """Fold in another group's statistics exactly (pairwise mean/scatter update).
+
+        scatter may be memory-mapped; it is read into the running matrix in place.
+        """
+        if count:
+            self.scatter += scatter
+            self._add_moments(count, mean)
+        return self
+
+    def merge(self, other):
+        return self.add(other.count, other.mean, other.scatter)
+
+
+def _top_eigh(matrix, k, overwrite=False):
+    """Top-k eigenpairs of a symmetric matrix in decreasing order (overwrite lets scipy reuse matrix)."""
+    n = matrix.shape[0]
+    k = min(k, n)
+    try:
+        from scipy.linalg import eigh
+        # matrix.T is the same symmetric matrix in Fortran order, which LAPACK can overwrite without a copy
+        values, vectors = eigh(matrix.T, subset_by_index=(n - k, n - 1), overwrite_a=overwrite)
+    except ImportError:
+        values, vectors = np.linalg.eigh(matrix)
+        values, vectors = values[n - k:], vectors[:, n - k:]
+    return values[::-1], vectors[:, ::-1]
+
+
+class ImageShard:
+    """A slice of the dataset that a worker can decode on its own."""
+
+    def __init__(self, image_paths, chunk_size=CHUNK_SIZE):
+        self.image_paths = image_paths
+        self.chunk_size = chunk_size
+
+    def __len__(self):
+        return len(self.image_paths)
+
+    def chunks(self):
+        return iter_image_chunks(self.image_paths, self.chunk_size)
+
+
+def shard_images(by_class, n_shards, chunk_size=CHUNK_SIZE):
+    """Split the list_images_by_class output into n_shards contiguous, equally sized shards."""
+    paths = [img for images in by_class.values() for img in images]
+    n_shards = max(1, min(n_shards, len(paths)))
+    bounds = np.linspace(0, len(paths), n_shards + 1).astype(int)
+    return [ImageShard(paths[start:stop], chunk_size) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+class TensorShard:
+    """Rows [start, stop) of a prepared dataset tensor, memory-mapped on demand."""
+
+    def __init__(self, tensor_path, start, stop, chunk_size=CHUNK_SIZE):
+        self.tensor_path = tensor_path
+        self.start = start
+        self.stop = stop
+        self.chunk_size = chunk_size
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def chunks(self):
+        faces = np.load(self.tensor_path, mmap_mode='r')
+        for offset in range(self.start, self.stop, self.chunk_size):
+            yield faces[offset:min(offset + self.chunk_size, self.stop)]
+
+
+def shard_tensor(tensor_path, n_shards, chunk_size=CHUNK_SIZE):
+    """Split a prepared dataset tensor (see dataset.py) into n_shards row ranges."""
+    n_samples = len(np.load(tensor_path, mmap_mode='r'))
+    n_shards = max(1, min(n_shards, n_samples))
+    bounds = np.linspace(0, n_samples, n_shards + 1).astype(int)
+    return [TensorShard(tensor_path, start, stop, chunk_size) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+# Per-shard partial sums. These run inside pool workers, so they are module
+# level and only return what the exact reduce step in the solvers needs.
+
+def _shard_sum(shard):
+    total = 0.0
+    count = 0
+    for chunk in shard.chunks():
+        total = total + chunk.reshape(len(chunk), -1).sum(axis=0, dtype=np.float64)
+        count += len(chunk)
+    return count, total
+
+
+def _shard_scatter(shard, dim, spill_dir):
+    """(count, mean, path) of a shard; the scatter is written to a .npy in spill_dir,
+    so the parent memory-maps it instead of unpickling a copy."""
+    acc = ScatterAccumulator(dim)
+    for chunk in shard.chunks():
+        acc.update(chunk)
+    fd, path = tempfile.mkstemp(suffix=".npy", dir=spill_dir)
+    with os.fdopen(fd, "wb") as f:
+        np.save(f, acc.scatter)
+    return acc.count, acc.mean, path
+
+
+def _shard_power_step(shard, mean_face, Q):
+    Z = np.zeros_like(Q)
+    for chunk in shard.chunks():
+        X = chunk.reshape(len(chunk), -1) - mean_face
+        Z += X.T @ (X @ Q)
+    return Z
+
+
+def _shard_projected_scatter(shard, mean_face, Q):
+    small = np.zeros((Q.shape[1], Q.shape[1]))
+    for chunk in shard.chunks():
+        Y = (chunk.reshape(len(chunk), -1) - mean_face) @ Q
+        small += Y.T @ Y
+    return small
+
+
+def _shard_load(shard):
+    chunks = [chunk.reshape(len(chunk), -1).astype(np.float32) for chunk in shard.chunks()]
+    return np.concatenate(chunks) if chunks else None
+
+
+def _map_shards(func, shards, pool):
+    """Run func over every shard, in the pool when there is one, with progress."""
+    results = pool.map(func, shards) if pool is not None else map(func, shards)
+    yield from tqdm(results, total=len(shards))
+
+
+def _streamed_mean(shards, pool):
+    count, total = 0, 0.0
+    for shard_count, shard_total in _map_shards(_shard_sum, shards, pool):
+        count += shard_count
+        total = total + shard_total
+    if count == 0:
+        raise ValueError("No readable images to train on")
+    return count, total / count
+
+
+def solve_gram(shards, n_components, pool=None):
+    """Gram trick: eigendecompose the n x n matrix, lift eigenvectors to pixel space."""
+    blocks = [block for block in _map_shards(_shard_load, shards, pool) if block is not None]
+    if not blocks:
+        raise ValueError("No readable images to train on")
+    X = np.concatenate(blocks)
+    del blocks
+    mean_face = X.mean(axis=0, dtype=np.float64)
+    X -= mean_face.astype(np.float32)
+    gram = (X @ X.T).astype(np.float64) / len(X)
+    eigen_values, vectors = _top_eigh(gram, n_components)
+    eigen_faces = X.T.astype(np.float64) @ vectors
+    eigen_faces /= np.linalg.norm(eigen_faces, axis=0)
+    return eigen_values, eigen_faces, mean_face
+
+
+def available_memory():
+    """Bytes of RAM available to new allocations (MemAvailable), or None where it cannot be read."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def covariance_workers(workers, dim, memory=None):
+    """Workers the covariance solver can run without swapping.
+
+    Every worker holds a float64 d x d scatter (1.66 GB at d = 14400) and
+    the parent one more to reduce into, so at most
+    COVARIANCE_MEMORY_FRACTION * memory // matrix - 1 workers fit; below two a pool only costs memory and the solver runs in
+    process on a single matrix.
+    """
+    memory = available_memory() if memory is None else memory
+    if memory is None:
+        return workers
+    fit = int(COVARIANCE_MEMORY_FRACTION * memory // (dim * dim * 8)) - 1
+    return workers if fit >= workers else (fit if fit >= 2 else 1)
+
+
+def solve_covariance(shards, n_components, dim, pool=None, spill_dir=None):
+    """Accumulate per-shard d x d scatter matrices, reduce them into one, take the top-k eigenvectors.
+
+    Without a pool every shard goes into a single accumulator. With one, the
+    first shard's scatter becomes the reduce buffer and the others are
+    folded into it as they arrive; workers hand theirs over as temporary
+    .npy files in spill_dir (default: the system temp dir, often RAM-backed,
+    so train.py passes --spill_dir), which are memory-mapped rather than
+    unpickled.
+    """
+    if pool is None:
+        acc = ScatterAccumulator(dim)
+        for shard in tqdm(shards):
+            for chunk in shard.chunks():
+                acc.update(chunk)
+        return _covariance_eigh(acc, n_components)
+
+    acc = None
+    if spill_dir is not None:
+        os.makedirs(spill_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix="scatter", dir=spill_dir) as spill_dir:
+        scatter = partial(_shard_scatter, dim=dim, spill_dir=spill_dir)
+        for count, mean, path in _map_shards(scatter, shards, pool):
+            shard_scatter = np.load(path, mmap_mode="r" if acc is not None else None)
+            os.remove(path)
+            if acc is None:
+                acc = ScatterAccumulator.from_stats(count, mean, shard_scatter)
+            else:
+                acc.add(count, mean, shard_scatter)
+            del shard_scatter
+    return _covariance_eigh(acc, n_components)
+
+
+def _covariance_eigh(acc, n_components):
+    if acc is None or acc.count == 0:
+        raise ValueError("No readable images to train on")
+    acc.scatter /= acc.count
+    eigen_values, eigen_faces = _top_eigh(acc.scatter, n_components, overwrite=True)
+    return eigen_values, eigen_faces, acc.mean
+
+
+def solve_randomized(shards, n_components, dim, pool=None, power_iterations=POWER_ITERATIONS, seed=0):
+    """Randomized subspace iteration on X^T X, one streamed pass per iteration.
+
+    Only d x (k + oversamples) blocks are kept in memory; the final pass
+    projects the data onto the subspace and solves the small l x l problem.
+    Every pass is a sum over shards, so it reduces exactly across workers.
+    """
+    count, mean_face = _streamed_mean(shards, pool)
+    width = min(n_components + OVERSAMPLES, dim, count)
+    Q = np.random.default_rng(seed).standard_normal((dim, width))
+
+    for _ in range(power_iterations + 1):
+        Q, _ = np.linalg.qr(Q)
+        Q = sum(_map_shards(partial(_shard_power_step, mean_face=mean_face, Q=Q), shards, pool))
+
+    Q, _ = np.linalg.qr(Q)
+    small = sum(_map_shards(partial(_shard_projected_scatter, mean_face=mean_face, Q=Q), shards, pool))
+    eigen_values, vectors = _top_eigh(small / count, n_components)
+    return eigen_values, Q @ vectors, mean_face
+
+
+def solve_incremental(shards, n_components):
+    """Single sequential pass; the basis merge is order dependent so it is not sharded."""
+    pca = IncrementalPCA(n_components)
+    for shard in tqdm(shards):
+        for chunk in shard.chunks():
+            pca.partial_fit(chunk)
+    if pca.n_samples == 0:
+        raise ValueError("No readable images to train on")
+    return pca.eigen_values, pca.components.T, pca.mean
+
+
+def select_solver(n_samples, dim, n_components):
+    """Pick the cheapest exact-enough solver from the n (images) vs d (pixels) shape."""
+    if n_components <= RANDOMIZED_MAX_FRACTION * min(n_samples, dim):
+        return "randomized"
+    if n_samples <= dim:
+        return "gram"
+    return "covariance"
+
+
+SOLVERS = ("auto", "randomized", "gram", "covariance", "incremental")
+
+
+def save_artifacts(eigen_values, eigen_faces, mean_face, out_dir=".", suffix=""):
+    """Write eigen_faces{suffix}.npy (d x k), mean_faces{suffix}.npy, eigen_values{suffix}.npy
+    and the memory-mappable eigen_faces{suffix}.efb used by the live scripts."""
+    os.makedirs(out_dir, exist_ok=True)
+    write_basis(os.path.join(out_dir, f"eigen_faces{suffix}.efb"), eigen_faces, mean_face, eigen_values,
+                resolution=(target_dim[1], target_dim[0]))
+    np.save(os.path.join(out_dir, f"eigen_faces{suffix}.npy"), eigen_faces)
+    np.save(os.path.join(out_dir, f"mean_faces{suffix}.npy"), mean_face)
+    np.save(os.path.join(out_dir, f"eigen_values{suffix}.npy"), eigen_values)
+
+
+def train(shards, n_components=NUM_COMPONENTS, solver="auto", workers=1, spill_dir=None):
+    """Fit eigenfaces on ImageShard/TensorShard shards; returns (eigen_values, eigen_faces, mean_face).
+
+    spill_dir is where covariance workers hand over their scatter matrices.
+    """
+    if solver not in SOLVERS:
+        raise ValueError(f"Unknown solver: {solver}")
+    n_samples = sum(len(shard) for shard in shards)
+    dim = target_dim[0] * target_dim[1]
+    if solver == "auto":
+        solver = select_solver(n_samples, dim, n_components)
+    print(f"Training {n_components} eigenfaces on {n_samples} images with the {solver} solver "
+          f"({len(shards)} shards)")
+
+    if solver == "incremental":
+        return solve_incremental(shards, n_components)
+    if solver == "covariance":
+        capped = covariance_workers(workers, dim)
+        if capped < workers:
+            print(f"Covariance solver: {capped} worker(s) instead of {workers}, "
+                  f"each needs a {dim * dim * 8 / 2 ** 30:.2f} GB scatter matrix")
+            workers = capped
+
+    pool = ProcessPoolExecutor(workers) if workers > 1 else None
+    try:
+        if solver == "randomized":
+            return solve_randomized(shards, n_components, dim, pool)
+        if solver == "gram":
+            return solve_gram(shards, n_components, pool)
+        return solve_covariance(shards, n_components, dim, pool, spill_dir)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train eigenfaces out-of-core")
+    parser.add_argument('data_path', help="Directory with one sub-directory of images per class")
+    parser.add_argument('--components', type=int, default=NUM_COMPONENTS)
+    parser.add_argument('--chunk_size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--solver', choices=SOLVERS, default="auto")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Processes to shard the dataset across")
+    parser.add_argument('--cache_dir', help="Decode once into a cached uint8 tensor here (see dataset.py) "
+                                            "and train from the memory-mapped copy")
+    parser.add_argument('--out_dir', default=".")
+    parser.add_argument('--spill_dir', help="Where covariance workers hand over their d x d scatter matrices "
+                                            "(default: out_dir; avoid a RAM-backed /tmp)")
+    parser.add_argument('--suffix', default="", help="Artifact suffix, e.g. _f for eigen_faces_f.npy")
+    parser.add_argument('--holdout', help="Held-out face tensor (dataset.py) to sweep k on after training; "
+                                          "writes rd_curve{suffix}.json (see evaluate.py)")
+
+    args = parser.parse_args()
+
+    if args.cache_dir:
+        prepare_dataset(args.data_path, args.cache_dir, args.workers)
+        shards = shard_tensor(os.path.join(args.cache_dir, TENSOR_FILE), args.workers, args.chunk_size)
+    else:
+        by_class = list_images_by_class(args.data_path)
+        print(f"Found {sum(map(len, by_class.values()))} images in {len(by_class)} classes")
+        shards = shard_images(by_class, args.workers, args.chunk_size)
+
+    eigen_values, eigen_faces, mean_face = train(shards, args.components, args.solver, args.workers,
+                                                 args.spill_dir or args.out_dir)
+    save_artifacts(eigen_values, eigen_faces, mean_face, args.out_dir, args.suffix)
+    print(f"Saved {eigen_faces.shape[1]} eigenfaces to {args.out_dir}")
+
+    if args.holdout:
+        from basis import open_basis
+        from evaluate import rate_distortion, save_curve, summarize
+
+        curve = rate_distortion(open_basis(os.path.join(args.out_dir, f"eigen_faces{args.suffix}.efb")),
+                                np.load(args.holdout, mmap_mode='r'))
+        print(summarize(curve))
+        save_curve(curve, os.path.join(args.out_dir, f"rd_curve{args.suffix}.json"))